@@ -6,6 +6,7 @@
 import asyncio
 import json
 from pathlib import Path
+import numpy as np
 from personal_gym_trainer import PersonalGymTrainer, UserProfile, WorkoutSession
 import datetime
 
@@ -52,25 +53,36 @@ async def create_demo_data():
     print("\n📊 サンプルセッションデータ作成中...")
     
     # サンプルセッションデータ作成
+    rng = np.random.default_rng()
+    session_count = 15  # 各ユーザー15セッション
     for user in users:
+        # 運動タイプをレベルに応じて選択
+        if user.fitness_level == "beginner":
+            exercises = ["squat", "push_up"]
+            max_reps = [12, 8]
+            form_range = (0.5, 0.8)
+        elif user.fitness_level == "intermediate":
+            exercises = ["squat", "push_up", "plank"]
+            max_reps = [15, 12, 45]  # プランクは秒数
+            form_range = (0.7, 0.9)
+        else:
+            exercises = ["squat", "push_up", "deadlift", "plank"]
+            max_reps = [20, 18, 12, 60]
+            form_range = (0.8, 1.0)
+        
+        # ランダムな値をユーザーごとにまとめて生成
+        ex_indices = rng.integers(0, len(exercises), size=session_count)
+        durations = rng.integers(10, 31, size=session_count)
+        variations = rng.uniform(0.7, 1.2, size=session_count)
+        form_scores = rng.uniform(*form_range, size=session_count)
+        feedback_counts = rng.integers(0, 4, size=session_count)
+        
         # 過去30日間のランダムなセッションを生成
-        for i in range(15):  # 各ユーザー15セッション
+        for i in range(session_count):
             days_ago = 30 - (i * 2)
             session_time = datetime.datetime.now() - datetime.timedelta(days=days_ago, hours=2)
             
-            # 運動タイプをレベルに応じて選択
-            if user.fitness_level == "beginner":
-                exercises = ["squat", "push_up"]
-                max_reps = [12, 8]
-            elif user.fitness_level == "intermediate":
-                exercises = ["squat", "push_up", "plank"]
-                max_reps = [15, 12, 45]  # プランクは秒数
-            else:
-                exercises = ["squat", "push_up", "deadlift", "plank"]
-                max_reps = [20, 18, 12, 60]
-            
-            import random
-            ex_idx = random.randint(0, len(exercises) - 1)
+            ex_idx = int(ex_indices[i])
             exercise_type = exercises[ex_idx]
             
             # セッション作成
@@ -78,21 +90,14 @@ async def create_demo_data():
                 user_id=user.user_id,
                 exercise_type=exercise_type,
                 start_time=session_time,
-                end_time=session_time + datetime.timedelta(minutes=random.randint(10, 30))
+                end_time=session_time + datetime.timedelta(minutes=int(durations[i]))
             )
             
             # ランダムなパフォーマンスデータ
-            base_reps = max_reps[ex_idx]
-            variation = random.uniform(0.7, 1.2)
-            session.rep_count = int(base_reps * variation)
+            session.rep_count = int(max_reps[ex_idx] * variations[i])
             
             # フォームスコア（レベルに応じて調整）
-            if user.fitness_level == "beginner":
-                session.form_score = random.uniform(0.5, 0.8)
-            elif user.fitness_level == "intermediate":
-                session.form_score = random.uniform(0.7, 0.9)
-            else:
-                session.form_score = random.uniform(0.8, 1.0)
+            session.form_score = float(form_scores[i])
             
             # カロリー計算
             exercise_info = trainer.exercise_database.get(exercise_type, {})
@@ -103,14 +108,13 @@ async def create_demo_data():
                 session.calories_burned = duration * exercise_info["calories_per_second"]
             
             # フィードバック生成
-            feedback_count = random.randint(0, 3)
-            for _ in range(feedback_count):
-                if session.form_score < 0.7:
-                    session.feedback_notes.append("フォームに注意してください")
-                elif session.form_score > 0.9:
-                    session.feedback_notes.append("素晴らしいフォームです！")
-                else:
-                    session.feedback_notes.append("良いペースです")
+            if session.form_score < 0.7:
+                feedback = "フォームに注意してください"
+            elif session.form_score > 0.9:
+                feedback = "素晴らしいフォームです！"
+            else:
+                feedback = "良いペースです"
+            session.feedback_notes.extend([feedback] * int(feedback_counts[i]))
             
             user.workout_history.append(session)
     
@@ -0,0 +1,34 @@
+"""
+gunicornの設定ファイル
+起動例: gunicorn -c gunicorn.conf.py gym_dashboard:app
+"""
+
+import os
+
+# RailwayではPORT環境変数が自動的に設定される
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+# ユーザープロフィール・分析履歴・可視化ジョブはプロセス内メモリに保持しているため、
+# ワーカーを増やすと状態が食い違う。既定は1ワーカーとし、並列度はスレッド数で調整する
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+# スレッドワーカー: アップロードの受信やファイル入出力の待ち時間に他のリクエストを処理する
+# （OpenCV・PyTorchは処理中にGILを解放するため、geventのようなモンキーパッチは不要）
+worker_class = "gthread"
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = 120  # 動画の分析に時間がかかるため長めに設定
+
+# マスタープロセスでアプリ（ライブラリのimport）を読み込み、ワーカー間で共有する
+preload_app = True
+
+
+def when_ready(server):
+    """ワーカーをforkする前にマスタープロセスで設定を読み込む"""
+    from gym_dashboard import initialize_app
+    # torch/OpenMPのスレッドプールやCUDAはfork後の子プロセスで安全に使えないため、
+    # モデルのロードと推論はマスターでは行わない
+    initialize_app(warm_up=False)
+
+
+def post_worker_init(worker):
+    """各ワーカーでモデルをロードし、ウォームアップの推論を行う"""
+    from gym_dashboard import warm_up_posture_detector
+    warm_up_posture_detector()
@@ -4,16 +4,25 @@
 Webベースの管理インターフェース
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from jinja2 import FileSystemBytecodeCache
 import json
 import datetime
 import os
 import base64
+import shutil
+import uuid
+from functools import lru_cache
+from itertools import chain
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import logging
+import mimetypes
 
 # ロガー設定（他のインポートより先に設定）
 logging.basicConfig(
@@ -26,8 +35,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 from personal_gym_trainer import PersonalGymTrainer, UserProfile, WorkoutSession
-from posture_analyzer import PostureAnalyzer, PostureAnalysis
-from posture_detector import PostureDetector
+from posture_analyzer import PostureAnalyzer, PostureAnalysis, KEYPOINT_NAMES, keypoints_to_array, pose_outlier_mask
+from posture_detector import PostureDetectorPool
 from posture_visualizer import PostureVisualizer
 from posture_type_detector import PostureTypeDetector
 try:
@@ -46,37 +55,253 @@ except ImportError as e:
     LINE_AVAILABLE = False
     LINENotifier = None
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import pybase64
+    b64decode = pybase64.b64decode
+    PYBASE64_AVAILABLE = True
+except ImportError:
+    b64decode = base64.b64decode
+    PYBASE64_AVAILABLE = False
+
+try:
+    import av
+    PYAV_AVAILABLE = True
+except ImportError:
+    PYAV_AVAILABLE = False
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    turbo_jpeg = TurboJPEG()
+    TURBOJPEG_AVAILABLE = True
+except Exception as e:
+    # モジュール未インストール、またはlibjpeg-turboが見つからない場合
+    logger.info(f"TurboJPEGは利用できません（cv2でデコードします）: {e}")
+    TURBOJPEG_AVAILABLE = False
+    turbo_jpeg = None
+
+try:
+    import cv2
+    # SIMD/IPP最適化を有効にし、内部スレッド数はPyTorch・可視化スレッドと分け合う
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(max(1, (os.cpu_count() or 1) // 2))
+except ImportError:
+    pass
+
 # 環境変数を読み込み
 load_dotenv()
 
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify等のJSONシリアライズをorjsonで行うプロバイダー"""
+    
+    # レスポンスのキー順は元の辞書の順序のまま（ソートしない）
+    sort_keys = False
+    
+    def _orjson_dumps(self, obj) -> bytes:
+        if ORJSON_AVAILABLE:
+            # numpyのスカラー・配列（分析結果のスコア等）もfloat()変換なしでそのままシリアライズ
+            return orjson.dumps(
+                obj, default=self.default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            )
+        return super().dumps(obj).encode('utf-8')
+    
+    def dumps(self, obj, **kwargs):
+        if kwargs or not ORJSON_AVAILABLE:
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        if kwargs or not ORJSON_AVAILABLE:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # str経由の変換をせず、orjsonのbytesをそのままレスポンスにする
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._orjson_dumps(obj), mimetype=self.mimetype)
+
+
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
+app.json = OrjsonProvider(app)
+
+# テンプレート設定: コンパイル済みテンプレートをメモリとディスクにキャッシュ
+# （本番ではテンプレートの更新チェックを行わない）
+app.config['TEMPLATES_AUTO_RELOAD'] = os.getenv('DEBUG', 'false').lower() == 'true'
+# ディレクトリ未指定時はJinja2がユーザーごとに権限0700の一時ディレクトリを作成して使う
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
+
+@lru_cache(maxsize=4096)
+def _cached_url_for(script_root, endpoint, values):
+    """URL生成結果のキャッシュ本体（script_rootごとに区別）"""
+    return url_for(endpoint, **dict(values))
+
+
+def cached_url_for(endpoint, **values):
+    """テンプレート用のurl_for（同じ引数のURL生成結果を再利用）"""
+    # 外部URLやアンカー指定などの特殊な引数はキャッシュしない
+    if any(key.startswith('_') for key in values):
+        return url_for(endpoint, **values)
+    try:
+        key = tuple(sorted(values.items()))
+        hash(key)
+    except TypeError:
+        return url_for(endpoint, **values)
+    return _cached_url_for(request.script_root, endpoint, key)
+
+
+app.jinja_env.globals['url_for'] = cached_url_for
 
 # ファイルアップロード設定
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mov', 'avi', 'webm'}
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'webm'}
+# 拡張子チェック用（str.endswithにそのまま渡せる形）
+_ALLOWED_SUFFIXES = tuple('.' + ext for ext in ALLOWED_EXTENSIONS)
+_VIDEO_SUFFIXES = tuple('.' + ext for ext in VIDEO_EXTENSIONS)
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # アップロード保存時の書き込み単位（1MB）
+HISTORY_PAGE_SIZE = 50  # 姿勢診断履歴APIの1ページあたりの件数
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
+# Apache（mod_xsendfile）やlighttpd配下ではX-Sendfileでファイル送信をWebサーバーに任せる
+# （nginxはX-Sendfileを解釈せず空のファイルが返るため、nginxではX_ACCEL_*_PREFIXを使う）
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
+# nginxのinternal locationのパス（例: /_internal_vis/）。設定すると可視化画像はX-Accel-Redirectで返す
+X_ACCEL_VISUALIZATIONS_PREFIX = os.getenv('X_ACCEL_VISUALIZATIONS_PREFIX', '')
+# アップロードフォルダ全体を指すinternal location（例: /_internal_uploads/）。設定するとすべてのファイルをX-Accel-Redirectで返す
+X_ACCEL_UPLOADS_PREFIX = os.getenv('X_ACCEL_UPLOADS_PREFIX', '')
 
 # アップロードフォルダを作成
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(os.path.join(UPLOAD_FOLDER, 'images'), exist_ok=True)
 os.makedirs(os.path.join(UPLOAD_FOLDER, 'videos'), exist_ok=True)
-os.makedirs(os.path.join(UPLOAD_FOLDER, 'visualizations'), exist_ok=True)  # 可視化画像用ディレクトリ
-os.makedirs(os.path.join(UPLOAD_FOLDER, 'pdfs'), exist_ok=True)  # PDF出力用ディレクトリ
+VISUALIZATION_FOLDER = os.path.join(UPLOAD_FOLDER, 'visualizations')  # 可視化画像用ディレクトリ
+PDF_FOLDER = os.path.join(UPLOAD_FOLDER, 'pdfs')  # PDF出力用ディレクトリ
+# 起動時に作成済みのため、リクエストごとのmakedirsは行わない
+os.makedirs(VISUALIZATION_FOLDER, exist_ok=True)
+os.makedirs(PDF_FOLDER, exist_ok=True)
 
 def allowed_file(filename):
     """許可されたファイル拡張子かチェック"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return filename.lower().endswith(_ALLOWED_SUFFIXES)
 
 def is_video_file(filename):
     """動画ファイルかチェック"""
-    video_extensions = {'mp4', 'mov', 'avi', 'webm'}
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in video_extensions
+    return filename.lower().endswith(_VIDEO_SUFFIXES)
+
+def jpeg_reduce_factor(image_bytes):
+    """
+    JPEGをデコード時に縮小する倍率を決める（YOLOの入力は640pxなので長辺640px以上は残す）
+    
+    ヘッダーだけを読んで画像サイズを取得する。JPEG以外、またはサイズが取れない場合は1
+    """
+    if image_bytes[:2] != b'\xff\xd8':
+        return 1
+    try:
+        if TURBOJPEG_AVAILABLE:
+            width, height, _, _ = turbo_jpeg.decode_header(image_bytes)
+        else:
+            from PIL import Image
+            import io
+            width, height = Image.open(io.BytesIO(image_bytes)).size
+    except Exception:
+        return 1
+    
+    long_side = max(width, height)
+    if long_side > 2560:
+        return 4
+    if long_side >= 1280:
+        return 2
+    return 1
+
+
+def decode_image_bytes(image_bytes, scale=1):
+    """
+    画像バイト列をBGR画像（numpy array）にデコード
+    
+    JPEGはTurboJPEG（libjpeg-turbo）でデコードし、それ以外やEXIF付きの画像は
+    回転補正のためcv2.imdecodeを使用する。scaleに2または4（jpeg_reduce_factorの値）を
+    指定すると、JPEGをDCTのスケーリングで1/scaleに縮小しながらデコードする
+    """
+    factor = scale if image_bytes[:2] == b'\xff\xd8' else 1
+    
+    if (TURBOJPEG_AVAILABLE and image_bytes[:2] == b'\xff\xd8'
+            and image_bytes.find(b'Exif\x00\x00', 0, 128) == -1):
+        try:
+            return turbo_jpeg.decode(image_bytes, pixel_format=TJPF_BGR, scaling_factor=(1, factor))
+        except Exception as e:
+            logger.warning(f"TurboJPEGでのデコードに失敗しました。cv2にフォールバックします: {e}")
+    
+    import cv2
+    flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4}[factor]
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flags)
+
+def scale_keypoints(keypoints, scale):
+    """キーポイントの座標（x, y）をscale倍する（縮小デコードした画像と元の画像の座標変換用）"""
+    if scale == 1:
+        return keypoints
+    return {
+        name: (point[0] * scale, point[1] * scale, *point[2:])
+        for name, point in keypoints.items()
+    }
+
+
+def decode_data_uri(data):
+    """
+    data URI（data:image/jpeg;base64,...）またはBase64文字列をバイト列にデコード
+    
+    ヘッダーは先頭付近のカンマだけを探して取り除く（split()で全体をコピーしない）
+    """
+    comma = data.find(',', 0, 64)
+    if comma >= 0:
+        data = data[comma + 1:]
+    return b64decode(data)
+
+
+def to_keypoints_tuple(keypoints):
+    """
+    キーポイントを {name: (x, y, confidence)} のfloatタプル形式に変換
+    
+    座標が2要素未満のものは除外し、信頼度がない場合は1.0とする。
+    float変換は要素ごとではなくnumpyで一括して行う
+    """
+    names = []
+    points = []
+    for name, point in keypoints.items():
+        if isinstance(point, (list, tuple)) and len(point) >= 2:
+            names.append(name)
+            points.append((point[0], point[1], point[2] if len(point) >= 3 else 1.0))
+    if not points:
+        return {}
+    return dict(zip(names, map(tuple, np.asarray(points, dtype=np.float64).tolist())))
+
+
+def decode_keypoints_bin(keypoints_bin):
+    """
+    バイナリ形式のキーポイントを辞書に変換
+    
+    keypoints_binはCOCO順17点 ×(x, y, confidence) のリトルエンディアンfloat16配列を
+    Base64エンコードしたもの（102バイト）。未検出のキーポイントはNaNで表す。
+    """
+    values = np.frombuffer(b64decode(keypoints_bin), dtype='<f2')
+    if values.size != len(KEYPOINT_NAMES) * 3:
+        raise ValueError(f"keypoints_binのサイズが不正です: {values.size}")
+    kp_array = values.astype(np.float32).reshape(len(KEYPOINT_NAMES), 3)
+    valid = ~np.isnan(kp_array).any(axis=1)
+    return {
+        KEYPOINT_NAMES[i]: tuple(kp_array[i].tolist())
+        for i in np.flatnonzero(valid)
+    }
 
 # グローバルトレーナーインスタンス
 try:
@@ -94,8 +319,10 @@ except Exception as e:
     logger.error(f"PostureAnalyzerの初期化に失敗しました: {e}", exc_info=True)
     raise
 
-# 姿勢検出器インスタンス（必要に応じて初期化）
+# 姿勢検出器インスタンス（起動時のウォームアップ、または初回リクエストで初期化）
 posture_detector = None
+# 同時リクエストでモデルが重複ロードされないようにするためのロック
+posture_detector_lock = threading.Lock()
 
 # 姿勢可視化器インスタンス
 try:
@@ -140,19 +367,224 @@ if PDF_AVAILABLE:
 else:
     logger.info("PDF生成機能は利用できません（reportlabがインストールされていません）")
 
+# 同時に推論できる検出器の数（gunicornのスレッド数に合わせる）
+DETECTOR_POOL_SIZE = int(os.getenv('DETECTOR_POOL_SIZE', os.getenv('GUNICORN_THREADS', '4')))
+
+
+def select_posture_device():
+    """推論デバイスを決定（POSTURE_DEVICEで指定がなければ、CUDAが使える場合はGPU）"""
+    device = os.getenv('POSTURE_DEVICE', 'auto')
+    if device != 'auto':
+        return device
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+    except ImportError:
+        pass
+    return "cpu"
+
+
 def get_posture_detector():
-    """姿勢検出器を取得（遅延初期化）"""
+    """姿勢検出器のプールを取得（遅延初期化、検出器自体は使用時に作成）"""
     global posture_detector
-    if posture_detector is None:
+    if posture_detector is not None:
+        return posture_detector
+    
+    with posture_detector_lock:
+        if posture_detector is not None:
+            return posture_detector
         try:
             # 精度向上のため、信頼度閾値を0.25に設定（より敏感な検出）
-            posture_detector = PostureDetector(device="cpu", conf_threshold=0.25)
+            # POSTURE_BACKEND=onnx-int8 / openvino-int8 でONNX Runtime・OpenVINO（int8量子化）推論に切り替え
+            posture_detector = PostureDetectorPool(
+                size=DETECTOR_POOL_SIZE,
+                device=select_posture_device(),
+                conf_threshold=0.25,
+                backend=os.getenv('POSTURE_BACKEND', 'torch')
+            )
         except Exception as e:
             logger.warning(f"姿勢検出器の初期化に失敗しました: {e}")
             posture_detector = None
     return posture_detector
 
 
+def warm_up_posture_detector():
+    """起動時にプールの全検出器をロードし、それぞれダミー画像で1回推論しておく"""
+    try:
+        import torch
+        # 検出器が並列に推論するため、コア数を検出器の数で分け合う
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // DETECTOR_POOL_SIZE))
+    except ImportError:
+        pass
+    
+    pool = get_posture_detector()
+    if pool is None:
+        return
+    try:
+        pool.fill()
+        dummy_image = np.zeros((640, 640, 3), dtype=np.uint8)
+        for _ in range(pool.size):
+            with pool.lease() as detector:
+                detector.detect_keypoints(dummy_image)
+        logger.info(f"姿勢検出器のウォームアップが完了しました（{pool.size}個）")
+    except Exception as e:
+        logger.warning(f"姿勢検出器のウォームアップに失敗しました: {e}")
+
+
+# 可視化画像の種類: (レスポンスのキー, ファイル名の接頭辞, ログ用の名称)
+VISUALIZATION_TYPES = (
+    ("visualized_image_url", "analyzed", "可視化画像"),
+    ("report_image_url", "report", "診断結果レポート画像"),
+    ("xray_image_url", "xray", "X線透視風画像"),
+)
+
+# 可視化画像の保存形式（jpg: 高速・小サイズ、png: 可逆圧縮）
+VISUALIZATION_IMAGE_FORMAT = os.getenv('VISUALIZATION_IMAGE_FORMAT', 'jpg')
+VISUALIZATION_JPEG_QUALITY = 90
+# PNGを選んだ場合も既定の圧縮レベル(3)より速いBEST_SPEED相当で保存する
+VISUALIZATION_PNG_COMPRESSION = 1
+
+# 可視化画像の生成・保存用スレッドプール（cv2の描画・エンコードはGILを解放する）
+visualization_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='visualization')
+
+
+def _render_visualization(prefix, image, keypoints, analysis, output_path):
+    """
+    可視化画像を1枚生成して保存（ワーカースレッドで実行）
+    
+    output_pathがNoneの場合は保存せず、JPEGのdata URI文字列を返す
+    """
+    import cv2
+    if prefix == "analyzed":
+        # 通常の可視化画像（キーポイントと骨格を直接描画）
+        output_image = posture_visualizer.visualize_posture(image, keypoints, analysis, draw_text=False)
+    elif prefix == "report":
+        # 診断結果レポート画像（問題点・改善提案を含む）
+        output_image = posture_visualizer.create_diagnosis_report_image(image, keypoints, analysis)
+    else:
+        # X線透視風の画像診断
+        output_image = posture_visualizer.create_xray_visualization(image, keypoints, analysis)
+    
+    if output_path is None:
+        ok, buffer = cv2.imencode('.jpg', output_image, [cv2.IMWRITE_JPEG_QUALITY, VISUALIZATION_JPEG_QUALITY])
+        if not ok:
+            return None
+        return 'data:image/jpeg;base64,' + base64.b64encode(buffer).decode('ascii')
+    
+    # PNGのzlib圧縮は遅いため、通常はJPEGで保存する（PNGの場合も低圧縮レベルで保存）
+    if output_path.endswith('.jpg'):
+        params = [cv2.IMWRITE_JPEG_QUALITY, VISUALIZATION_JPEG_QUALITY]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, VISUALIZATION_PNG_COMPRESSION]
+    return cv2.imwrite(output_path, output_image, params)
+
+
+def submit_visualizations(
+    image, keypoints, analysis, name_suffix,
+    prefixes=("analyzed", "report", "xray"), image_format=None
+):
+    """
+    可視化画像の生成をスレッドプールに投入（完了は待たない）
+    
+    Args:
+        image: 入力画像（BGR形式）
+        keypoints: キーポイント辞書 {name: (x, y, confidence)}
+        analysis: 姿勢分析結果
+        name_suffix: ファイル名の接頭辞以降の部分（拡張子なし）
+        prefixes: 生成する画像の種類
+        image_format: 保存形式（'jpg' または 'png'、省略時はVISUALIZATION_IMAGE_FORMAT）。
+            'inline'の場合はファイルに保存せず、JPEGのdata URIとして返す
+    
+    Returns:
+        ジョブのリスト [(レスポンスのキー, ログ用の名称, ファイル名, 保存先, Future), ...]
+    """
+    inline = image_format == 'inline'
+    extension = 'png' if (image_format or VISUALIZATION_IMAGE_FORMAT) == 'png' else 'jpg'
+    jobs = []
+    for url_key, prefix, label in VISUALIZATION_TYPES:
+        if prefix not in prefixes:
+            continue
+        if inline:
+            filename, output_path = None, None
+        else:
+            filename = f"{prefix}_{name_suffix}.{extension}"
+            output_path = os.path.join(VISUALIZATION_FOLDER, filename)
+        future = visualization_executor.submit(_render_visualization, prefix, image, keypoints, analysis, output_path)
+        jobs.append((url_key, label, filename, output_path, future))
+    return jobs
+
+
+def collect_visualizations(jobs):
+    """
+    submit_visualizationsのジョブの完了を待ち、保存に成功した画像のURL辞書を返す
+    
+    URL生成はリクエストコンテキストが必要なため呼び出し元のスレッドで行う。
+    インラインのジョブはURLの代わりに *_image_b64 キーでdata URIを返す
+    """
+    urls = {}
+    for url_key, label, filename, output_path, future in jobs:
+        try:
+            if output_path is None:
+                data_uri = future.result()
+                if data_uri:
+                    urls[url_key.replace('_url', '_b64')] = data_uri
+                else:
+                    logger.error(f"{label}のエンコードに失敗")
+                continue
+            # cv2.imwriteの戻り値で成否を判定（ファイルの存在確認はデバッグ時のみ）
+            if future.result():
+                urls[url_key] = url_for('uploaded_file', filename=f'visualizations/{filename}')
+                if app.debug:
+                    logger.debug(f"{label}を保存: {output_path} ({os.path.getsize(output_path)} bytes), URL: {urls[url_key]}")
+            else:
+                logger.error(f"{label}の保存に失敗: {output_path}")
+        except Exception as e:
+            logger.error(f"{label}生成エラー: {e}", exc_info=True)
+    
+    return urls
+
+
+def generate_visualizations(image, keypoints, analysis, name_suffix, **kwargs):
+    """
+    可視化画像を並列に生成して保存（引数はsubmit_visualizationsと同じ）
+    
+    Returns:
+        保存に成功した画像のURL辞書 {"visualized_image_url": ..., ...}
+    """
+    return collect_visualizations(submit_visualizations(image, keypoints, analysis, name_suffix, **kwargs))
+
+
+# 非同期で生成中の可視化画像 {キー: ジョブのリスト}（/api/posture/visualizations/<key> で取得）
+pending_visualizations = {}
+pending_visualizations_lock = threading.Lock()
+MAX_PENDING_VISUALIZATIONS = 256
+
+
+def register_pending_visualizations(key, jobs):
+    """非同期生成のジョブを登録（上限を超えたら完了済みのものから破棄）"""
+    with pending_visualizations_lock:
+        if len(pending_visualizations) >= MAX_PENDING_VISUALIZATIONS:
+            for done_key in [k for k, v in pending_visualizations.items() if all(job[4].done() for job in v)]:
+                del pending_visualizations[done_key]
+        pending_visualizations[key] = jobs
+
+
+# PDFの非同期生成（async指定時）用のスレッドプールと生成中ジョブ
+pdf_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='pdf')
+pending_pdfs = {}
+pending_pdfs_lock = threading.Lock()
+
+
+def _generate_pdf_job(pdf_path, **kwargs):
+    """PDFを生成し、ファイルができたかどうかを返す（ワーカースレッドで実行）"""
+    try:
+        return pdf_generator.generate_diagnosis_pdf(output_path=pdf_path, **kwargs) and os.path.exists(pdf_path)
+    except Exception as e:
+        logger.error(f"PDF生成エラー（非同期）: {e}", exc_info=True)
+        return False
+
+
 @app.route('/')
 @app.route('/posture_diagnosis')
 def posture_diagnosis():
@@ -185,22 +617,22 @@ def posture_diagnosis_user(user_id):
         
         user = trainer.user_profiles[user_id]
         
-        # 過去の診断結果を読み込み
+        # 過去の診断結果を新しい順に10件読み込み
         try:
-            analyses = posture_analyzer.load_analyses(user_id)
+            analyses = posture_analyzer.load_analyses_recent(user_id, limit=10)
         except Exception as e:
             logger.error(f"診断結果の読み込みエラー: {e}", exc_info=True)
             analyses = []
         
         # 最新の診断結果
-        latest_analysis = analyses[-1] if analyses else None
+        latest_analysis = analyses[0] if analyses else None
         
         # 診断履歴
         history_data = []
         try:
-            for analysis in sorted(analyses, key=lambda a: a.timestamp, reverse=True)[:10]:
+            for analysis in analyses:
                 history_data.append({
-                    'date': analysis.timestamp.strftime('%Y-%m-%d %H:%M'),
+                    'date': analysis.timestamp.isoformat(sep=' ', timespec='minutes'),
                     'score': analysis.overall_score,
                     'posture_type': analysis.posture_type,
                     'issues_count': len(analysis.issues)
@@ -237,22 +669,33 @@ def api_posture_analyze():
     
     user_id = data.get('user_id')
     keypoints = data.get('keypoints', {})
+    keypoints_bin = data.get('keypoints_bin', None)  # Base64エンコードされたfloat16キーポイント
     image_data = data.get('image', None)  # Base64エンコードされた画像
     posture_type = data.get('posture_type', 'standing')
     
     if not user_id:
         return jsonify({"status": "error", "message": "user_idが必要です"}), 400
     
+    image = None
+    decode_scale = 1  # 縮小デコードした倍率（キーポイントは常に元の画像の座標で扱う）
+    keypoints_detected = False  # 検出器の出力は {name: (x, y, conf)} のfloatタプルなので変換不要
     try:
+        if keypoints_bin and not keypoints:
+            try:
+                keypoints = decode_keypoints_bin(keypoints_bin)
+            except Exception as e:
+                return jsonify({"status": "error", "message": f"keypoints_binの形式が不正です: {e}"}), 400
+        
         # 画像が提供されている場合、YOLOでキーポイントを検出
         if image_data:
             try:
                 # Base64デコード
-                image_bytes = base64.b64decode(image_data.split(',')[-1])
+                image_bytes = decode_data_uri(image_data)
                 try:
                     import cv2
-                    nparr = np.frombuffer(image_bytes, np.uint8)
-                    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                    # 携帯の高解像度写真は縮小デコード（検出は640pxで行うため精度は変わらない）
+                    decode_scale = jpeg_reduce_factor(image_bytes)
+                    image = decode_image_bytes(image_bytes, scale=decode_scale)
                 except ImportError:
                     # opencv-python-headlessがインストールされていない場合
                     logger.warning("cv2が利用できません。キーポイント検出をスキップします。")
@@ -268,7 +711,8 @@ def api_posture_analyze():
                         detected_keypoints = detector.detect_keypoints(image)
                         logger.info(f"検出されたキーポイント数: {len(detected_keypoints) if detected_keypoints else 0}")
                         if detected_keypoints:
-                            keypoints = detected_keypoints
+                            keypoints = scale_keypoints(detected_keypoints, decode_scale)
+                            keypoints_detected = True
                             # キーポイントのサンプルをログに記録（デバッグ用）
                             sample_keys = list(detected_keypoints.keys())[:3]
                             for key in sample_keys:
@@ -281,18 +725,15 @@ def api_posture_analyze():
         if not keypoints:
             return jsonify({"status": "error", "message": "keypointsまたはimageが必要です"}), 400
         
-        # キーポイントをタプル形式に変換
-        keypoints_tuple = {}
-        for name, point in keypoints.items():
-            if isinstance(point, (list, tuple)) and len(point) >= 2:
-                x, y = point[0], point[1]
-                conf = point[2] if len(point) >= 3 else 1.0
-                keypoints_tuple[name] = (float(x), float(y), float(conf))
+        # クライアントから受け取ったキーポイントはタプル形式に変換
+        keypoints_tuple = keypoints if keypoints_detected else to_keypoints_tuple(keypoints)
+        # 姿勢タイプ判定と分析で同じ (17, 3) 配列を使う
+        kp_array = keypoints_to_array(keypoints_tuple)
         
         # 姿勢タイプが指定されていない場合、または'auto'の場合、自動判定
         if not posture_type or posture_type == 'auto' or posture_type == 'standing':
             try:
-                detected_type, confidence = posture_type_detector.get_posture_type_confidence(keypoints_tuple)
+                detected_type, confidence = posture_type_detector.get_posture_type_confidence_array(kp_array)
                 posture_type = detected_type
                 logger.info(f"姿勢タイプを自動判定: {detected_type} (信頼度: {confidence:.2f})")
             except Exception as e:
@@ -300,79 +741,42 @@ def api_posture_analyze():
                 posture_type = 'standing_front'
         
         # 姿勢を分析
-        analysis = posture_analyzer.analyze_posture(keypoints_tuple, posture_type)
+        analysis = posture_analyzer.analyze_posture(keypoints_tuple, posture_type, kp_array=kp_array)
+        
+        # 画像が提供されている場合、可視化画像・診断結果レポート画像の生成を並列に開始
+        # （async_visualizations=trueの場合は完了を待たずに返し、クライアントがポーリングで取得する）
+        jobs = []
+        if image is not None:
+            try:
+                if data.get('async_visualizations'):
+                    # ポーリング用のキーはファイル名にも使うため、同じ秒の分析と衝突しないようuuidにする
+                    visualization_key = uuid.uuid4().hex
+                else:
+                    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+                    visualization_key = f"{user_id}_{timestamp}"
+                vis_keypoints = scale_keypoints(keypoints, 1 / decode_scale)
+                # ?format=png で可逆形式、?format=inline でファイルに保存せずレスポンスに埋め込む
+                image_format = request.args.get('format')
+                jobs = submit_visualizations(
+                    image, vis_keypoints, analysis, visualization_key, image_format=image_format
+                )
+                if image_format == 'inline' and request.args.get('persist') == '1':
+                    # インラインに加えてファイルにも保存（URLも返す）
+                    jobs += submit_visualizations(image, vis_keypoints, analysis, visualization_key)
+            except Exception as e:
+                logger.error(f"画像生成エラー: {e}", exc_info=True)
         
-        # 結果を保存
+        # 結果を保存（可視化画像の生成と並行して書き込む）
         posture_analyzer.save_analysis(user_id, analysis)
         
-        # 画像が提供されている場合、診断結果レポート画像を生成
-        report_image_url = None
-        visualized_image_url = None
-        if image is not None:
+        image_urls = {}
+        if jobs:
             try:
-                timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-                
-                # 可視化ディレクトリを確実に作成
-                vis_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'visualizations')
-                os.makedirs(vis_dir, exist_ok=True)
-                logger.info(f"可視化ディレクトリ: {vis_dir}, 存在: {os.path.exists(vis_dir)}")
-                
-                # 通常の可視化画像も生成（キーポイントと骨格を直接描画）
-                try:
-                    visualized_image = posture_visualizer.visualize_posture(image, keypoints, analysis, draw_text=False)
-                    vis_filename = f"analyzed_{user_id}_{timestamp}.png"
-                    vis_path = os.path.join(vis_dir, vis_filename)
-                    success1 = cv2.imwrite(vis_path, visualized_image)
-                    if success1 and os.path.exists(vis_path):
-                        visualized_image_url = url_for('uploaded_file', filename=f'visualizations/{vis_filename}')
-                        logger.info(f"可視化画像を保存: {vis_path}, URL: {visualized_image_url}")
-                    else:
-                        logger.error(f"可視化画像の保存に失敗: {vis_path}")
-                        visualized_image_url = None
-                except Exception as e:
-                    logger.error(f"可視化画像生成エラー: {e}", exc_info=True)
-                    visualized_image_url = None
-                
-                # 診断結果レポート画像を生成
-                try:
-                    report_image = posture_visualizer.create_diagnosis_report_image(image, keypoints, analysis)
-                    report_filename = f"report_{user_id}_{timestamp}.png"
-                    report_path = os.path.join(vis_dir, report_filename)
-                    
-                    success2 = cv2.imwrite(report_path, report_image)
-                    if success2:
-                        # ファイルが実際に保存されたか確認
-                        if os.path.exists(report_path):
-                            file_size = os.path.getsize(report_path)
-                            logger.info(f"診断結果レポート画像を保存: {report_path}, サイズ: {file_size} bytes")
-                            report_image_url = url_for('uploaded_file', filename=f'visualizations/{report_filename}')
-                            logger.info(f"診断結果レポート画像URL: {report_image_url}")
-                        else:
-                            logger.error(f"画像ファイルが保存されませんでした: {report_path}")
-                            report_image_url = None
-                    else:
-                        logger.error(f"cv2.imwriteが失敗: {report_path}")
-                        report_image_url = None
-                except Exception as e:
-                    logger.error(f"診断結果レポート画像生成エラー: {e}", exc_info=True)
-                    report_image_url = None
-                
-                # X線透視風の画像診断
-                xray_image_url = None
-                try:
-                    xray_image = posture_visualizer.create_xray_visualization(image, keypoints, analysis)
-                    xray_filename = f"xray_{user_id}_{timestamp}.png"
-                    xray_path = os.path.join(vis_dir, xray_filename)
-                    success_xray = cv2.imwrite(xray_path, xray_image)
-                    if success_xray and os.path.exists(xray_path):
-                        xray_image_url = url_for('uploaded_file', filename=f'visualizations/{xray_filename}')
-                        logger.info(f"X線透視風画像を保存: {xray_path}, URL: {xray_image_url}")
-                    else:
-                        logger.error(f"X線透視風画像の保存に失敗: {xray_path}")
-                        xray_image_url = None
-                except Exception as e:
-                    logger.error(f"X線透視風画像生成エラー: {e}", exc_info=True)
-                    xray_image_url = None
+                if data.get('async_visualizations'):
+                    register_pending_visualizations(visualization_key, jobs)
+                    image_urls = {"visualizations_pending": True, "visualization_key": visualization_key}
+                else:
+                    image_urls = collect_visualizations(jobs)
             except Exception as e:
                 logger.error(f"画像生成エラー: {e}", exc_info=True)
         
@@ -391,14 +795,9 @@ def api_posture_analyze():
             }
         }
         
-        if report_image_url:
-            response["report_image_url"] = report_image_url
-        if visualized_image_url:
-            response["visualized_image_url"] = visualized_image_url
-        if xray_image_url:
-            response["xray_image_url"] = xray_image_url
+        response.update(image_urls)
         
-        logger.info(f"姿勢分析レスポンス: report_image_url={report_image_url}, visualized_image_url={visualized_image_url}, xray_image_url={xray_image_url}")
+        logger.info(f"姿勢分析レスポンス: {image_urls}")
         
         return jsonify(response)
     
@@ -417,19 +816,40 @@ def api_posture_history(user_id):
         if user_id not in trainer.user_profiles:
             return jsonify({"status": "error", "message": "ユーザーが見つかりません"}), 404
         
-        analyses = posture_analyzer.load_analyses(user_id)
+        # データベース側で新しい順に並べて取得（pageを指定した場合はその1ページ分のみ）
+        page = request.args.get('page', type=int)
+        if page is None:
+            analyses = posture_analyzer.iter_analyses_recent(user_id, limit=None)
+        else:
+            per_page = max(request.args.get('per_page', HISTORY_PAGE_SIZE, type=int), 1)
+            analyses = posture_analyzer.iter_analyses_recent(
+                user_id, limit=per_page, offset=max(page - 1, 0) * per_page
+            )
         
-        history = []
-        for analysis in sorted(analyses, key=lambda a: a.timestamp, reverse=True):
-            history.append({
-                "timestamp": analysis.timestamp.isoformat(),
-                "overall_score": analysis.overall_score,
-                "posture_type": analysis.posture_type,
-                "issues_count": len(analysis.issues),
-                "issues": analysis.issues
-            })
+        # 最初の1件はここで取得し、データベースの接続・クエリのエラーは500として返す
+        first = next(analyses, None)
+        
+        def generate():
+            # 全件のリストを作らず、1件ずつJSONにして送信する
+            yield '{"status": "success", "history": ['
+            try:
+                for i, analysis in enumerate(chain((first,), analyses) if first is not None else ()):
+                    entry = app.json.dumps({
+                        "timestamp": analysis.timestamp.isoformat(),
+                        "overall_score": analysis.overall_score,
+                        "posture_type": analysis.posture_type,
+                        "issues_count": len(analysis.issues),
+                        "issues": analysis.issues
+                    })
+                    yield entry if i == 0 else ',' + entry
+            except Exception as e:
+                # 送信開始後はステータスを変えられないため、配列を閉じてエラーを付けた有効なJSONにする
+                logger.error(f"姿勢診断履歴APIエラー（送信中）: {e}", exc_info=True)
+                yield '], "error": ' + app.json.dumps(str(e)) + '}'
+                return
+            yield ']}'
         
-        return jsonify({"status": "success", "history": history})
+        return Response(stream_with_context(generate()), mimetype='application/json')
     except Exception as e:
         logger.error(f"姿勢診断履歴APIエラー: {e}", exc_info=True)
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -454,6 +874,37 @@ def api_posture_summary(user_id):
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route('/api/posture/visualizations/<key>')
+def api_posture_visualizations(key):
+    """非同期で生成した可視化画像の取得API（生成中はpending=trueを返す）"""
+    if os.path.basename(key) != key:
+        return jsonify({"status": "error", "message": "不正なキーです"}), 400
+    
+    with pending_visualizations_lock:
+        jobs = pending_visualizations.get(key)
+    if jobs is not None:
+        if not all(job[4].done() for job in jobs):
+            return jsonify({"status": "success", "pending": True})
+        # 再試行されたポーリングにも同じ結果を返せるよう、完了後もジョブは残す（上限超過時に破棄）
+        response = {"status": "success", "pending": False}
+        response.update(collect_visualizations(jobs))
+        return jsonify(response)
+    
+    # 別のワーカープロセスで生成された場合や再起動後は、保存済みのファイルから返す
+    urls = {}
+    for url_key, prefix, _label in VISUALIZATION_TYPES:
+        for extension in ('jpg', 'png'):
+            filename = f"{prefix}_{key}.{extension}"
+            if os.path.exists(os.path.join(VISUALIZATION_FOLDER, filename)):
+                urls[url_key] = url_for('uploaded_file', filename=f'visualizations/{filename}')
+                break
+    if not urls:
+        return jsonify({"status": "error", "message": "可視化画像が見つかりません"}), 404
+    response = {"status": "success", "pending": False}
+    response.update(urls)
+    return jsonify(response)
+
+
 @app.route('/api/posture/upload', methods=['POST'])
 def api_posture_upload():
     """動画・画像アップロードAPI"""
@@ -484,15 +935,18 @@ def api_posture_upload():
         else:
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'images', safe_filename)
         
-        file.save(filepath)
-        
         # 画像または動画から姿勢分析を実行
         if is_video_file(filename):
-            # 動画からフレームを抽出して分析
+            # 動画は1MB単位でストリーム書き込み（メモリ使用量を一定に保つ）してからフレームを抽出して分析
+            with open(filepath, 'wb') as f:
+                shutil.copyfileobj(file.stream, f, length=UPLOAD_CHUNK_SIZE)
             result = analyze_video_posture(filepath, user_id, posture_type)
         else:
-            # 画像から姿勢分析
-            result = analyze_image_posture(filepath, user_id, posture_type)
+            # 画像はメモリ上のバイト列から分析する（レスポンスのfile_urlがすぐ参照できるよう先に保存）
+            image_bytes = file.stream.read()
+            with open(filepath, 'wb') as f:
+                f.write(image_bytes)
+            result = analyze_image_posture(filepath, user_id, posture_type, image_bytes=image_bytes)
         
         if result['status'] == 'success':
             response_data = {
@@ -517,11 +971,21 @@ def api_posture_upload():
         return jsonify({"status": "error", "message": str(e), "details": error_details}), 500
 
 
-def analyze_image_posture(image_path, user_id, posture_type):
-    """画像から姿勢分析"""
+def analyze_image_posture(image_path, user_id, posture_type, image_bytes=None):
+    """
+    画像から姿勢分析
+    
+    image_bytesを指定した場合はファイルを読まずにそのバイト列をデコードする
+    （image_pathは可視化画像のファイル名にのみ使う）
+    """
     try:
         import cv2
-        image = cv2.imread(image_path)
+        # 大きなJPEGは縮小デコード（キーポイントは元の画像の座標に戻して分析する）
+        if image_bytes is None:
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+        decode_scale = jpeg_reduce_factor(image_bytes)
+        image = decode_image_bytes(image_bytes, scale=decode_scale)
         
         if image is None:
             return {"status": "error", "message": "画像の読み込みに失敗しました"}
@@ -535,18 +999,15 @@ def analyze_image_posture(image_path, user_id, posture_type):
         if not detected_keypoints:
             return {"status": "error", "message": "姿勢が検出できませんでした"}
         
-        # キーポイントをタプル形式に変換
-        keypoints_tuple = {}
-        for name, point in detected_keypoints.items():
-            if isinstance(point, (list, tuple)) and len(point) >= 2:
-                x, y = point[0], point[1]
-                conf = point[2] if len(point) >= 3 else 1.0
-                keypoints_tuple[name] = (float(x), float(y), float(conf))
+        # 検出器の出力は既に {name: (x, y, conf)} のfloatタプル形式なので座標の変換だけ行う
+        keypoints_tuple = scale_keypoints(detected_keypoints, decode_scale)
+        # 姿勢タイプ判定と分析で同じ (17, 3) 配列を使う
+        kp_array = keypoints_to_array(keypoints_tuple)
         
         # 姿勢タイプが指定されていない場合、自動判定
         if not posture_type or posture_type == 'auto' or posture_type == 'standing':
             try:
-                detected_type, confidence = posture_type_detector.get_posture_type_confidence(keypoints_tuple)
+                detected_type, confidence = posture_type_detector.get_posture_type_confidence_array(kp_array)
                 posture_type = detected_type
                 logger.info(f"姿勢タイプを自動判定: {detected_type} (信頼度: {confidence:.2f})")
             except Exception as e:
@@ -554,79 +1015,25 @@ def analyze_image_posture(image_path, user_id, posture_type):
                 posture_type = 'standing_front'
         
         # 姿勢を分析
-        analysis = posture_analyzer.analyze_posture(keypoints_tuple, posture_type)
-        posture_analyzer.save_analysis(user_id, analysis)
-        
-        # 画像に姿勢評価を可視化
-        visualized_image_url = None
-        report_image_url = None
+        analysis = posture_analyzer.analyze_posture(keypoints_tuple, posture_type, kp_array=kp_array)
         
+        # 画像に姿勢評価を可視化（可視化画像・診断結果レポート・X線透視風を並列に生成）
+        jobs = []
         try:
             timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
             base_filename = os.path.splitext(os.path.basename(image_path))[0]
-            
-            # 可視化ディレクトリを確実に作成
-            vis_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'visualizations')
-            os.makedirs(vis_dir, exist_ok=True)
-            logger.info(f"可視化ディレクトリ: {vis_dir}, 存在: {os.path.exists(vis_dir)}")
-            
-            # 通常の可視化画像（キーポイントと骨格を直接描画）
-            try:
-                visualized_image = posture_visualizer.visualize_posture(image, detected_keypoints, analysis, draw_text=False)
-                output_filename = f"analyzed_{timestamp}_{base_filename}.png"
-                output_path = os.path.join(vis_dir, output_filename)
-                success1 = cv2.imwrite(output_path, visualized_image)
-                if success1 and os.path.exists(output_path):
-                    file_size = os.path.getsize(output_path)
-                    visualized_image_url = url_for('uploaded_file', filename=f'visualizations/{output_filename}')
-                    logger.info(f"可視化画像を保存: {output_path}, サイズ: {file_size} bytes, URL: {visualized_image_url}")
-                else:
-                    logger.error(f"可視化画像の保存に失敗: {output_path}")
-                    visualized_image_url = None
-            except Exception as e:
-                logger.error(f"可視化画像生成エラー: {e}", exc_info=True)
-                visualized_image_url = None
-            
-            # 診断結果レポート画像（問題点・改善提案を含む）
-            try:
-                report_image = posture_visualizer.create_diagnosis_report_image(image, detected_keypoints, analysis)
-                report_filename = f"report_{timestamp}_{base_filename}.png"
-                report_path = os.path.join(vis_dir, report_filename)
-                success2 = cv2.imwrite(report_path, report_image)
-                if success2 and os.path.exists(report_path):
-                    file_size = os.path.getsize(report_path)
-                    report_image_url = url_for('uploaded_file', filename=f'visualizations/{report_filename}')
-                    logger.info(f"診断結果レポート画像を保存: {report_path}, サイズ: {file_size} bytes, URL: {report_image_url}")
-                else:
-                    logger.error(f"診断結果レポート画像の保存に失敗: {report_path}, success={success2}, exists={os.path.exists(report_path) if report_path else False}")
-                    report_image_url = None
-            except Exception as e:
-                logger.error(f"診断結果レポート画像生成エラー: {e}", exc_info=True)
-                report_image_url = None
-            
-            # X線透視風の画像診断
-            xray_image_url = None
-            try:
-                xray_image = posture_visualizer.create_xray_visualization(image, detected_keypoints, analysis)
-                xray_filename = f"xray_{timestamp}_{base_filename}.png"
-                xray_path = os.path.join(vis_dir, xray_filename)
-                success_xray = cv2.imwrite(xray_path, xray_image)
-                if success_xray and os.path.exists(xray_path):
-                    file_size_xray = os.path.getsize(xray_path)
-                    xray_image_url = url_for('uploaded_file', filename=f'visualizations/{xray_filename}')
-                    logger.info(f"X線透視風画像を保存: {xray_path}, サイズ: {file_size_xray} bytes, URL: {xray_image_url}")
-                else:
-                    logger.error(f"X線透視風画像の保存に失敗: {xray_path}")
-                    xray_image_url = None
-            except Exception as e:
-                logger.error(f"X線透視風画像生成エラー: {e}", exc_info=True)
-                xray_image_url = None
-            
+            jobs = submit_visualizations(image, detected_keypoints, analysis, f"{timestamp}_{base_filename}")
+        except Exception as e:
+            logger.error(f"画像可視化エラー: {e}", exc_info=True)
+        
+        # 可視化画像の生成と並行して分析結果を保存
+        posture_analyzer.save_analysis(user_id, analysis)
+        
+        image_urls = {}
+        try:
+            image_urls = collect_visualizations(jobs)
         except Exception as e:
             logger.error(f"画像可視化エラー: {e}", exc_info=True)
-            visualized_image_url = None
-            report_image_url = None
-            xray_image_url = None
         
         result = {
             "status": "success",
@@ -642,15 +1049,10 @@ def analyze_image_posture(image_path, user_id, posture_type):
             }
         }
         
-        # URLを追加（Noneでも追加）
-        if visualized_image_url:
-            result["visualized_image_url"] = visualized_image_url
-        if report_image_url:
-            result["report_image_url"] = report_image_url
-        if xray_image_url:
-            result["xray_image_url"] = xray_image_url
+        # 保存に成功した画像のURLを追加
+        result.update(image_urls)
         
-        logger.info(f"analyze_image_posture結果: visualized_image_url={visualized_image_url}, report_image_url={report_image_url}, xray_image_url={xray_image_url}")
+        logger.info(f"analyze_image_posture結果: {image_urls}")
         
         return result
     
@@ -662,125 +1064,247 @@ def analyze_image_posture(image_path, user_id, posture_type):
         return {"status": "error", "message": str(e)}
 
 
+# PyAVでこのフレーム数以上の動画は、対象フレームごとにキーフレームへシークして読み込む
+VIDEO_SEEK_MIN_FRAMES = 300
+
+# 動画診断で姿勢検出に渡すフレームの最大幅（これより大きいフレームは縮小して検出）
+VIDEO_DETECTION_MAX_WIDTH = 960
+
+# 直前に検出したフレームとの平均ハッシュ（64bit）の差がこれ以下なら同じ姿勢とみなして検出を省略
+DUPLICATE_FRAME_HASH_DISTANCE = 2
+
+# 動画診断で問題点をまとめる際の重症度の優先順位
+ISSUE_SEVERITY_RANK = {'low': 0, 'medium': 1, 'high': 2}
+
+
+def _frame_average_hash(frame):
+    """フレームの平均ハッシュ（8x8グレースケールの明暗を64bitにしたもの）"""
+    import cv2
+    small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (8, 8), interpolation=cv2.INTER_AREA)
+    return np.packbits(small > small.mean())
+
+
+def _hash_distance(hash_a, hash_b):
+    """平均ハッシュ同士のハミング距離"""
+    return int(np.unpackbits(hash_a ^ hash_b).sum())
+
+
+def _sample_frame_indices(total_frames):
+    """分析対象のフレーム番号（最初、中間、最後）"""
+    return {0, total_frames // 2, total_frames - 1}
+
+
+def _decode_av_frame_at(container, stream, frame_idx):
+    """
+    PyAVでframe_idx番目のフレームをシークして取得（BGR配列）
+    
+    キーフレームへシークしてから目的の時刻までデコードする。動画の末尾を
+    越えた場合は最後にデコードできたフレームを返す
+    """
+    frame_duration = 1 / (stream.average_rate * stream.time_base)
+    target_pts = int(frame_idx * frame_duration) + (stream.start_time or 0)
+    container.seek(target_pts, stream=stream, backward=True)
+    
+    last_frame = None
+    for frame in container.decode(stream):
+        last_frame = frame
+        # 半フレーム分の誤差は同じフレームとみなす
+        if frame.pts is None or frame.pts >= target_pts - frame_duration / 2:
+            break
+    return last_frame.to_ndarray(format='bgr24') if last_frame is not None else None
+
+
+def _read_video_frames_av(video_path):
+    """PyAVで対象フレームを取得（フレーム数が分からない場合はNone）"""
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        total_frames = stream.frames
+        if total_frames <= 0:
+            return None
+        
+        # コーデックのフレーム/スライス並列デコードを有効化
+        stream.thread_type = 'AUTO'
+        frame_indices = _sample_frame_indices(total_frames)
+        
+        # 長い動画は対象フレームの直前のキーフレームへシークし、途中のフレームのデコードを省く
+        if total_frames >= VIDEO_SEEK_MIN_FRAMES and stream.average_rate:
+            frames = {}
+            for frame_idx in sorted(frame_indices):
+                frame = _decode_av_frame_at(container, stream, frame_idx)
+                if frame is not None:
+                    frames[frame_idx] = frame
+            return total_frames, frames
+        
+        last_index = max(frame_indices)
+        frames = {}
+        for frame_idx, frame in enumerate(container.decode(stream)):
+            # BGR配列への変換は対象フレームだけ行う
+            if frame_idx in frame_indices:
+                frames[frame_idx] = frame.to_ndarray(format='bgr24')
+            if frame_idx >= last_index:
+                break
+        return total_frames, frames
+
+
+def _read_video_frames_cv2(video_path):
+    """cv2.VideoCaptureで対象フレームを取得（開けない場合はNone）"""
+    import cv2
+    
+    # 利用可能ならハードウェアデコード（使えない環境ではソフトウェアデコードになる）
+    if hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):
+        cap = cv2.VideoCapture(
+            video_path, cv2.CAP_ANY,
+            [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+        )
+    else:
+        cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        frames = {}
+        if total_frames == 0:
+            return total_frames, frames
+        
+        # CAP_PROP_POS_FRAMESでのシークはキーフレームからの再デコードが発生するため、
+        # 先頭から1回だけ順に読み進め、対象フレームだけをretrieveで取り出す
+        frame_indices = _sample_frame_indices(total_frames)
+        for frame_idx in range(max(frame_indices) + 1):
+            if not cap.grab():
+                break
+            if frame_idx not in frame_indices:
+                continue
+            
+            ret, frame = cap.retrieve()
+            if ret:
+                frames[frame_idx] = frame
+        return total_frames, frames
+    finally:
+        cap.release()
+
+
+def read_video_frames(video_path):
+    """
+    動画の最初・中間・最後のフレームを取得
+    
+    PyAVが利用可能ならスレッド並列デコードで読み込み、使えない場合は
+    cv2.VideoCaptureで読み込む。
+    
+    Returns:
+        (総フレーム数, {フレーム番号: BGR画像}) のタプル。開けない場合はNone
+    """
+    if PYAV_AVAILABLE:
+        try:
+            video = _read_video_frames_av(video_path)
+            if video is not None:
+                return video
+        except Exception as e:
+            logger.warning(f"PyAVでの動画デコードに失敗しました（cv2で再試行します）: {e}")
+    return _read_video_frames_cv2(video_path)
+
+
 def analyze_video_posture(video_path, user_id, posture_type):
     """動画から姿勢分析（最初のフレームと中間フレームを分析）"""
     try:
-        import cv2
-        
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
+        # 分析するフレーム（最初、中間、最後）を1回の順次デコードで取得
+        video = read_video_frames(video_path)
+        if video is None:
             return {"status": "error", "message": "動画の読み込みに失敗しました"}
-        
-        # 動画の情報を取得
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames, frames_by_index = video
         
         if total_frames == 0:
             return {"status": "error", "message": "動画にフレームがありません"}
         
-        # 分析するフレームを選択（最初、中間、最後）
-        frame_indices = [0, total_frames // 2, total_frames - 1]
         analyses = []
+        first_frame = frames_by_index.get(0)
+        first_keypoints = None
         
         detector = get_posture_detector()
         if not detector:
             return {"status": "error", "message": "姿勢検出器が利用できません"}
         
-        for frame_idx in frame_indices:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            ret, frame = cap.read()
-            
-            if not ret:
-                continue
-            
-            # キーポイントを検出
-            detected_keypoints = detector.detect_keypoints(frame)
+        # 高解像度の動画は縮小してから検出し、座標は元のフレームの大きさに戻す
+        # （レポート画像は元の解像度のfirst_frameから生成する）
+        frames = list(frames_by_index.values())
+        frame_width = frames[0].shape[1] if frames else 0
+        detection_scale = 1
+        if frame_width > VIDEO_DETECTION_MAX_WIDTH:
+            import cv2
+            detection_scale = frame_width / VIDEO_DETECTION_MAX_WIDTH
+            frames = [
+                cv2.resize(
+                    frame,
+                    (VIDEO_DETECTION_MAX_WIDTH, round(frame.shape[0] / detection_scale)),
+                    interpolation=cv2.INTER_AREA
+                )
+                for frame in frames
+            ]
+        
+        # 直前に検出するフレームとほぼ同じフレーム（静止した姿勢）は検出を省略し、その結果を再利用する
+        detect_frames = []
+        source_positions = []
+        prev_hash = None
+        for frame in frames:
+            frame_hash = _frame_average_hash(frame)
+            if prev_hash is None or _hash_distance(frame_hash, prev_hash) > DUPLICATE_FRAME_HASH_DISTANCE:
+                detect_frames.append(frame)
+                prev_hash = frame_hash
+            source_positions.append(len(detect_frames) - 1)
+        
+        # 抽出したフレームのキーポイントを1回の推論でまとめて検出し、
+        # 検出できたフレームの分だけ (T, 17, 3) のバッファに詰める
+        detect_results = detector.detect_keypoints_batch(detect_frames)
+        kp_buffer = np.empty((len(frames), len(KEYPOINT_NAMES), 3), dtype=np.float64)
+        detected_count = 0
+        for i, detected_keypoints in enumerate(detect_results[position] for position in source_positions):
             if not detected_keypoints:
                 continue
+            if i == 0 and first_frame is not None:
+                # レポート画像用に最初のフレームの検出結果を保持（再検出しない）
+                first_keypoints = scale_keypoints(detected_keypoints, detection_scale)
+            keypoints_to_array(detected_keypoints, out=kp_buffer[detected_count])
+            detected_count += 1
+        detected = kp_buffer[:detected_count]
+        detected[:, :, :2] *= detection_scale
+        
+        # 他のフレームから大きく外れた誤検出フレームは分析せずに除外
+        if detected_count:
+            keep = pose_outlier_mask(detected)
+            if not keep.all():
+                logger.info(f"動画診断: 外れ値の{int((~keep).sum())}フレームを除外")
             
-            # キーポイントをタプル形式に変換
-            keypoints_tuple = {}
-            for name, point in detected_keypoints.items():
-                if isinstance(point, (list, tuple)) and len(point) >= 2:
-                    x, y = point[0], point[1]
-                    conf = point[2] if len(point) >= 3 else 1.0
-                    keypoints_tuple[name] = (float(x), float(y), float(conf))
-            
-            # 姿勢を分析
-            analysis = posture_analyzer.analyze_posture(keypoints_tuple, posture_type)
-            analyses.append(analysis)
-        
-        cap.release()
+            # 検出結果を (17, 3) 配列のまま分析（タプル辞書への変換を省略）
+            for kp_array in detected[keep]:
+                analyses.append(posture_analyzer.analyze_posture_array(kp_array, posture_type))
         
         if not analyses:
             return {"status": "error", "message": "動画から姿勢が検出できませんでした"}
         
         # 複数のフレームの平均を計算
-        avg_score = sum(a.overall_score for a in analyses) / len(analyses)
-        all_issues = []
-        for a in analyses:
-            all_issues.extend(a.issues)
+        scores = np.fromiter((a.overall_score for a in analyses), dtype=np.float64, count=len(analyses))
+        avg_score = float(scores.mean())
+        
+        # アライメントスコアも項目ごとに全フレームで平均（(フレーム数, 項目数) の行列で一括計算）
+        alignment_names = list(analyses[0].alignment_scores)
+        alignment_matrix = np.array(
+            [[a.alignment_scores.get(name, np.nan) for name in alignment_names] for a in analyses],
+            dtype=np.float64
+        )
+        avg_alignment_scores = dict(zip(alignment_names, np.nanmean(alignment_matrix, axis=0).tolist()))
         
-        # ユニークな問題点を取得
+        # ユニークな問題点を取得（同じ種類の問題は最も重症度の高いものを残す）
         unique_issues = {}
-        for issue in all_issues:
-            issue_type = issue['type']
-            if issue_type not in unique_issues or issue['severity'] == 'high':
-                unique_issues[issue_type] = issue
+        for issue in chain.from_iterable(a.issues for a in analyses):
+            current = unique_issues.get(issue['type'])
+            if current is None or (ISSUE_SEVERITY_RANK.get(issue['severity'], 0)
+                                   > ISSUE_SEVERITY_RANK.get(current['severity'], 0)):
+                unique_issues[issue['type']] = issue
         
         # 推奨事項を統合
-        all_recommendations = []
-        for a in analyses:
-            all_recommendations.extend(a.recommendations)
-        unique_recommendations = list(dict.fromkeys(all_recommendations))
-        
-        # 最初のフレームを取得してレポート画像を生成
-        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        ret, first_frame = cap.read()
-        report_image_url = None
-        
-        if ret and first_frame is not None:
-            try:
-                # 最初のフレームからキーポイントを再検出
-                first_keypoints = detector.detect_keypoints(first_frame)
-                if first_keypoints:
-                    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-                    base_filename = os.path.splitext(os.path.basename(video_path))[0]
-                    
-                    # 最終分析結果を作成（一時的に）
-                    temp_analysis = PostureAnalysis(
-                        timestamp=datetime.datetime.now(),
-                        overall_score=avg_score,
-                        posture_type=posture_type,
-                        issues=list(unique_issues.values()),
-                        recommendations=unique_recommendations,
-                        alignment_scores=analyses[0].alignment_scores if analyses else {},
-                        keypoint_angles=analyses[0].keypoint_angles if analyses else {},
-                        detailed_metrics=analyses[0].detailed_metrics if analyses else {},
-                        muscle_assessment=analyses[0].muscle_assessment if analyses and hasattr(analyses[0], 'muscle_assessment') else {"tight_muscles": [], "stretch_needed": [], "strengthen_needed": []}
-                    )
-                    
-                    # 可視化ディレクトリを確実に作成
-                    vis_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'visualizations')
-                    os.makedirs(vis_dir, exist_ok=True)
-                    
-                    # 診断結果レポート画像を生成
-                    report_image = posture_visualizer.create_diagnosis_report_image(
-                        first_frame, first_keypoints, temp_analysis
-                    )
-                    report_filename = f"report_{timestamp}_{base_filename}.png"
-                    report_path = os.path.join(vis_dir, report_filename)
-                    success = cv2.imwrite(report_path, report_image)
-                    if success and os.path.exists(report_path):
-                        report_image_url = url_for('uploaded_file', filename=f'visualizations/{report_filename}')
-                        logger.info(f"動画診断結果レポート画像を保存: {report_path}, URL: {report_image_url}")
-                    else:
-                        logger.error(f"動画診断結果レポート画像の保存に失敗: {report_path}")
-                        report_image_url = None
-            except Exception as e:
-                logger.warning(f"動画診断結果レポート画像生成エラー: {e}")
+        unique_recommendations = list(dict.fromkeys(chain.from_iterable(a.recommendations for a in analyses)))
         
-        # 最終分析結果を作成
+        # 最終分析結果を作成（レポート画像と保存の両方で使う）
         final_analysis = PostureAnalysis(
             timestamp=datetime.datetime.now(),
             posture_type=posture_type,
@@ -788,11 +1312,27 @@ def analyze_video_posture(video_path, user_id, posture_type):
             issues=list(unique_issues.values()),
             recommendations=unique_recommendations[:5],  # 上位5件
             keypoint_angles=analyses[0].keypoint_angles if analyses else {},
-            alignment_scores=analyses[0].alignment_scores if analyses else {},
+            alignment_scores=avg_alignment_scores,
             detailed_metrics=analyses[0].detailed_metrics if analyses else {},
             muscle_assessment=analyses[0].muscle_assessment if analyses and hasattr(analyses[0], 'muscle_assessment') else {"tight_muscles": [], "stretch_needed": [], "strengthen_needed": []}
         )
         
+        # 最初のフレーム（読み込み時に保持済み）からレポート画像を生成
+        report_image_url = None
+        
+        if first_frame is not None and first_keypoints:
+            try:
+                timestamp = final_analysis.timestamp.strftime('%Y%m%d_%H%M%S')
+                base_filename = os.path.splitext(os.path.basename(video_path))[0]
+                
+                # 診断結果レポート画像を生成
+                report_image_url = generate_visualizations(
+                    first_frame, first_keypoints, final_analysis,
+                    f"{timestamp}_{base_filename}", prefixes=("report",)
+                ).get("report_image_url")
+            except Exception as e:
+                logger.warning(f"動画診断結果レポート画像生成エラー: {e}")
+        
         posture_analyzer.save_analysis(user_id, final_analysis)
         
         result = {
@@ -825,20 +1365,35 @@ def analyze_video_posture(video_path, user_id, posture_type):
 def uploaded_file(filename):
     """アップロードされたファイルを提供"""
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        # ディレクトリトラバーサル攻撃を防ぐ（シンボリックリンクや .. を解決してから判定）
+        upload_root = Path(app.config['UPLOAD_FOLDER']).resolve()
+        file_path = (upload_root / filename).resolve()
+        if not file_path.is_relative_to(upload_root):
+            logger.warning(f"不正なパスアクセス: {filename}")
+            return "Forbidden", 403
+        
         # ファイルが存在するか確認
-        if not os.path.exists(file_path):
+        if not file_path.is_file():
             logger.warning(f"ファイルが見つかりません: {file_path}")
             return "File not found", 404
         
-        # ディレクトリトラバーサル攻撃を防ぐ
-        upload_folder_abs = os.path.abspath(app.config['UPLOAD_FOLDER'])
-        file_path_abs = os.path.abspath(file_path)
-        if not file_path_abs.startswith(upload_folder_abs):
-            logger.warning(f"不正なパスアクセス: {file_path}")
-            return "Forbidden", 403
-        
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        # nginxにsendfileで送信させる（Pythonでファイルを読まない）
+        if X_ACCEL_UPLOADS_PREFIX:
+            relative_path = file_path.relative_to(upload_root).as_posix()
+            return Response(
+                mimetype=mimetypes.guess_type(relative_path)[0] or 'application/octet-stream',
+                headers={'X-Accel-Redirect': X_ACCEL_UPLOADS_PREFIX.rstrip('/') + '/' + relative_path}
+            )
+        visualization_root = (upload_root / 'visualizations').resolve()
+        if X_ACCEL_VISUALIZATIONS_PREFIX and file_path.is_relative_to(visualization_root):
+            # リクエストのパスではなく解決後のパスから組み立てる（.. を含むパスをnginxに渡さない）
+            vis_filename = file_path.relative_to(visualization_root).as_posix()
+            return Response(
+                mimetype=mimetypes.guess_type(vis_filename)[0] or 'application/octet-stream',
+                headers={'X-Accel-Redirect': X_ACCEL_VISUALIZATIONS_PREFIX.rstrip('/') + '/' + vis_filename}
+            )
+        
+        return send_from_directory(upload_root, filename)
     except Exception as e:
         logger.error(f"ファイル提供エラー: {e}", exc_info=True)
         return f"Error: {str(e)}", 500
@@ -892,9 +1447,7 @@ def api_generate_pdf(user_id):
         # PDFファイル名を生成
         timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
         pdf_filename = f"posture_report_{user_id}_{timestamp}.pdf"
-        pdf_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'pdfs')
-        os.makedirs(pdf_dir, exist_ok=True)
-        pdf_path = os.path.join(pdf_dir, pdf_filename)
+        pdf_path = os.path.join(PDF_FOLDER, pdf_filename)
         
         # analysisを辞書形式に変換（PostureAnalysisオブジェクトの場合）
         if hasattr(analysis, '__dict__'):
@@ -914,10 +1467,7 @@ def api_generate_pdf(user_id):
             logger.error(f"予期しないanalysisの型: {type(analysis)}")
             return jsonify({"status": "error", "message": "分析データの形式が不正です"}), 400
         
-        # PDFを生成
-        logger.info(f"PDF生成を開始: user_id={user_id}, pdf_path={pdf_path}")
-        success = pdf_generator.generate_diagnosis_pdf(
-            output_path=pdf_path,
+        pdf_kwargs = dict(
             analysis=analysis_dict,
             user_id=user_id,
             user_name=user_name,
@@ -926,6 +1476,23 @@ def api_generate_pdf(user_id):
             visualized_image_path=visualized_image_path
         )
         
+        # async指定時はバックグラウンドで生成し、状態確認用のURLをすぐに返す
+        if data.get('async'):
+            job_id = os.path.splitext(pdf_filename)[0]
+            with pending_pdfs_lock:
+                pending_pdfs[job_id] = pdf_executor.submit(_generate_pdf_job, pdf_path, **pdf_kwargs)
+            logger.info(f"PDF生成をバックグラウンドで開始: user_id={user_id}, pdf_path={pdf_path}")
+            return jsonify({
+                "status": "success",
+                "pending": True,
+                "job_id": job_id,
+                "status_url": url_for('api_pdf_status', job_id=job_id)
+            }), 202
+        
+        # PDFを生成
+        logger.info(f"PDF生成を開始: user_id={user_id}, pdf_path={pdf_path}")
+        success = pdf_generator.generate_diagnosis_pdf(output_path=pdf_path, **pdf_kwargs)
+        
         if success and os.path.exists(pdf_path):
             pdf_url = url_for('uploaded_file', filename=f'pdfs/{pdf_filename}')
             logger.info(f"PDFを生成しました: {pdf_path}, URL: {pdf_url}")
@@ -942,6 +1509,34 @@ def api_generate_pdf(user_id):
         logger.error(f"PDF生成APIエラー: {e}", exc_info=True)
         return jsonify({"status": "error", "message": str(e)}), 500
 
+
+@app.route('/api/posture/pdf/status/<job_id>')
+def api_pdf_status(job_id):
+    """非同期で生成したPDFの状態確認API（生成中はpending=trueを返す）"""
+    if os.path.basename(job_id) != job_id:
+        return jsonify({"status": "error", "message": "不正なジョブIDです"}), 400
+    
+    with pending_pdfs_lock:
+        future = pending_pdfs.get(job_id)
+    if future is not None and not future.done():
+        return jsonify({"status": "success", "pending": True})
+    
+    with pending_pdfs_lock:
+        pending_pdfs.pop(job_id, None)
+    
+    # 別のワーカープロセスで生成された場合もファイルがあれば完了とみなす
+    pdf_filename = f"{job_id}.pdf"
+    if (future is None or future.result()) and os.path.exists(os.path.join(PDF_FOLDER, pdf_filename)):
+        return jsonify({
+            "status": "success",
+            "pending": False,
+            "pdf_url": url_for('uploaded_file', filename=f'pdfs/{pdf_filename}')
+        })
+    if future is None:
+        return jsonify({"status": "error", "message": "PDFが見つかりません"}), 404
+    return jsonify({"status": "error", "message": "PDF生成に失敗しました"}), 500
+
+
 @app.route('/api/posture/line/<user_id>', methods=['POST'])
 def api_send_line(user_id):
     """診断結果をLINEで送信"""
@@ -968,8 +1563,7 @@ def api_send_line(user_id):
                 return jsonify({"status": "error", "message": "LINEユーザーIDが必要です"}), 400
             
             # ユーザープロファイルにLINEユーザーIDを保存
-            user.line_user_id = line_user_id
-            trainer.save_config()
+            trainer.update_user_profile(user_id, line_user_id=line_user_id)
         
         # 分析データを取得
         data = request.json
@@ -1020,7 +1614,6 @@ def api_set_line_user_id(user_id):
         if user_id not in trainer.user_profiles:
             return jsonify({"status": "error", "message": "ユーザーが見つかりません"}), 404
         
-        user = trainer.user_profiles[user_id]
         data = request.json
         line_user_id = data.get('line_user_id', '').strip()
         
@@ -1028,8 +1621,7 @@ def api_set_line_user_id(user_id):
             return jsonify({"status": "error", "message": "LINEユーザーIDが必要です"}), 400
         
         # ユーザープロファイルにLINEユーザーIDを保存
-        user.line_user_id = line_user_id
-        trainer.save_config()
+        trainer.update_user_profile(user_id, line_user_id=line_user_id)
         
         return jsonify({
             "status": "success",
@@ -1042,14 +1634,23 @@ def api_set_line_user_id(user_id):
 
 
 
+def initialize_app(warm_up=True):
+    """起動時の初期化（設定の読み込みと姿勢検出器の事前ロード）"""
+    # 設定読み込み
+    try:
+        trainer.load_config()
+        logger.info("設定ファイルを読み込みました")
+    except Exception as e:
+        logger.warning(f"設定ファイルの読み込みに失敗しました（新規作成されます）: {e}")
+    
+    # 初回リクエストでモデルロードの待ち時間が発生しないように事前にロード
+    if warm_up:
+        warm_up_posture_detector()
+
+
 if __name__ == '__main__':
     try:
-        # 設定読み込み
-        try:
-            trainer.load_config()
-            logger.info("設定ファイルを読み込みました")
-        except Exception as e:
-            logger.warning(f"設定ファイルの読み込みに失敗しました（新規作成されます）: {e}")
+        initialize_app()
         
         print("""
 🌐 STLINE AI 姿勢診断システム起動
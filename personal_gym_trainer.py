@@ -12,15 +12,26 @@ Vision Agentsを使用したリアルタイム姿勢解析とトレーニング
 """
 
 import asyncio
+import atexit
 import logging
 import json
 import datetime
 import os
+import shutil
+import threading
+import time
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass, asdict
 from pathlib import Path
+import numpy as np
 from dotenv import load_dotenv
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 from vision_agents.core import User, Agent
 from vision_agents.core.agents import AgentLauncher
 from vision_agents.core.llm.realtime import Realtime
@@ -83,6 +94,8 @@ class WorkoutSession:
     def __post_init__(self):
         if self.feedback_notes is None:
             self.feedback_notes = []
+        # 集計用に開始時刻のエポック秒を保持（開始時刻はセッション作成後に変わらない）
+        self._start_epoch = self.start_time.timestamp() if isinstance(self.start_time, datetime.datetime) else None
 
 
 @dataclass
@@ -105,11 +118,33 @@ class UserProfile:
 class PersonalGymTrainer:
     """パーソナルジムトレーナー AI システム"""
     
+    # セッションログがこの件数に達したら設定ファイル全体を保存してログを空にする
+    SESSION_LOG_COMPACT_THRESHOLD = 100
+    # request_saveで予約された保存をまとめて書き込むまでの待ち時間（秒）
+    SAVE_INTERVAL = 2.0
+    
     def __init__(self, config_path: str = "gym_config.json"):
         self.config_path = Path(config_path)
+        # 完了セッションの追記ログ（設定ファイル全体を書き直さずに永続化）
+        self.session_log_path = self.config_path.with_suffix(".sessions.jsonl")
+        # 保存中に退避したセッションログ（設定ファイルの書き込みが終わったら削除）
+        self.session_checkpoint_path = self.config_path.with_suffix(".sessions.checkpoint.jsonl")
+        self._session_log_count = 0
         self.user_profiles: Dict[str, UserProfile] = {}
         self.current_session: Optional[WorkoutSession] = None
         self.exercise_database = self._load_exercise_database()
+        # 運動ID → 表示名のルックアップテーブル
+        self.exercise_names: Dict[str, str] = {
+            exercise_id: info.get("name", exercise_id) for exercise_id, info in self.exercise_database.items()
+        }
+        # ワークアウト履歴・セッションログ・保存用スナップショットを保護するロック
+        self._config_lock = threading.Lock()
+        # 設定ファイルの書き込みを直列化するロック
+        self._save_lock = threading.Lock()
+        # バックグラウンド保存（request_save）の状態
+        self._save_requested = threading.Event()
+        self._saver_thread: Optional[threading.Thread] = None
+        self._saver_lock = threading.Lock()
         
         # ログ設定
         logging.basicConfig(
@@ -358,7 +393,12 @@ YOLOの姿勢検出データと映像を組み合わせて、リアルタイム
         
         # ユーザープロファイルに記録
         if self.current_session.user_id in self.user_profiles:
-            self.user_profiles[self.current_session.user_id].workout_history.append(self.current_session)
+            # 保存のスナップショットとセッションログの退避の間に追記されないようロックする
+            with self._config_lock:
+                self.user_profiles[self.current_session.user_id].workout_history.append(self.current_session)
+                compact = self._append_session_log(self.current_session)
+            if compact:
+                self.request_save()
         
         completed_session = self.current_session
         self.current_session = None
@@ -368,9 +408,40 @@ YOLOの姿勢検出データと映像を組み合わせて、リアルタイム
     
     def add_user_profile(self, user_profile: UserProfile):
         """ユーザープロファイル追加"""
-        self.user_profiles[user_profile.user_id] = user_profile
+        with self._config_lock:
+            self.user_profiles[user_profile.user_id] = user_profile
         logger.info(f"👤 ユーザー追加: {user_profile.name}")
     
+    def update_user_profile(self, user_id: str, **changes: Any):
+        """
+        ユーザープロファイルの項目を更新して保存を予約
+        
+        バックグラウンド保存のスナップショットと同じロックの中で書き換えるため、
+        保存途中のプロファイルが変更されることはない
+        """
+        with self._config_lock:
+            profile = self.user_profiles[user_id]
+            for field_name, value in changes.items():
+                setattr(profile, field_name, value)
+        self.request_save()
+    
+    def _get_session_arrays(self, history: List[WorkoutSession]) -> Dict[str, Any]:
+        """ワークアウト履歴を列ごとのNumPy配列（SoA）に変換"""
+        count = len(history)
+        exercise_codes: Dict[str, int] = {}
+        arrays = {
+            "start_ts": np.fromiter((s._start_epoch for s in history), dtype=np.float64, count=count),
+            "exercise_code": np.fromiter(
+                (exercise_codes.setdefault(s.exercise_type, len(exercise_codes)) for s in history),
+                dtype=np.int32, count=count
+            ),
+            "rep_count": np.fromiter((s.rep_count for s in history), dtype=np.int64, count=count),
+            "form_score": np.fromiter((s.form_score for s in history), dtype=np.float64, count=count),
+            "calories": np.fromiter((s.calories_burned for s in history), dtype=np.float64, count=count),
+        }
+        arrays["exercise_types"] = list(exercise_codes)
+        return arrays
+    
     def get_workout_summary(self, user_id: str, days: int = 7) -> Dict[str, Any]:
         """ワークアウト履歴サマリー取得"""
         if user_id not in self.user_profiles:
@@ -379,26 +450,29 @@ YOLOの姿勢検出データと映像を組み合わせて、リアルタイム
         user = self.user_profiles[user_id]
         cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
         
-        recent_sessions = [
-            session for session in user.workout_history
-            if session.start_time >= cutoff_date
-        ]
+        # 期間内のセッションを抽出
+        arrays = self._get_session_arrays(user.workout_history)
+        recent = np.flatnonzero(arrays["start_ts"] >= cutoff_date.timestamp())
+        total_sessions = len(recent)
         
-        if not recent_sessions:
+        if total_sessions == 0:
             return {"message": f"過去{days}日間のワークアウト記録がありません"}
         
         # 統計計算
-        total_sessions = len(recent_sessions)
-        total_reps = sum(session.rep_count for session in recent_sessions)
-        total_calories = sum(session.calories_burned for session in recent_sessions)
-        average_form_score = sum(session.form_score for session in recent_sessions) / total_sessions
-        
-        exercise_breakdown = {}
-        for session in recent_sessions:
-            if session.exercise_type not in exercise_breakdown:
-                exercise_breakdown[session.exercise_type] = {"count": 0, "reps": 0}
-            exercise_breakdown[session.exercise_type]["count"] += 1
-            exercise_breakdown[session.exercise_type]["reps"] += session.rep_count
+        recent_reps = arrays["rep_count"][recent]
+        total_reps = int(recent_reps.sum())
+        total_calories = float(arrays["calories"][recent].sum())
+        average_form_score = float(arrays["form_score"][recent].mean())
+        
+        # 運動別の集計（np.bincountで1パス）
+        exercise_types = arrays["exercise_types"]
+        recent_codes = arrays["exercise_code"][recent]
+        counts = np.bincount(recent_codes, minlength=len(exercise_types))
+        reps_by_exercise = np.bincount(recent_codes, weights=recent_reps, minlength=len(exercise_types))
+        exercise_breakdown = {
+            exercise_types[code]: {"count": int(counts[code]), "reps": int(reps_by_exercise[code])}
+            for code in np.flatnonzero(counts)
+        }
         
         return {
             "period_days": days,
@@ -407,40 +481,185 @@ YOLOの姿勢検出データと映像を組み合わせて、リアルタイム
             "total_calories": round(total_calories, 1),
             "average_form_score": round(average_form_score, 2),
             "exercise_breakdown": exercise_breakdown,
-            "improvement_suggestions": self._generate_suggestions(user, recent_sessions)
+            "improvement_suggestions": self._generate_suggestions(
+                user, total_sessions, average_form_score, len(exercise_breakdown)
+            )
         }
     
-    def _generate_suggestions(self, user: UserProfile, sessions: List[WorkoutSession]) -> List[str]:
-        """改善提案を生成"""
+    def _generate_suggestions(
+        self,
+        user: UserProfile,
+        session_count: int,
+        average_form_score: float,
+        exercise_variety: int
+    ) -> List[str]:
+        """改善提案を生成（集計済みの値を使い、セッションを再走査しない）"""
         suggestions = []
         
         # フォームスコアが低い場合
-        avg_form_score = sum(s.form_score for s in sessions) / len(sessions)
-        if avg_form_score < 0.7:
+        if average_form_score < 0.7:
             suggestions.append("フォームの改善に重点を置きましょう。回数よりも正しいフォームを優先してください。")
         
         # 同じ運動ばかりしている場合
-        exercise_types = set(s.exercise_type for s in sessions)
-        if len(exercise_types) < 2:
+        if exercise_variety < 2:
             suggestions.append("運動のバリエーションを増やして、全身をバランス良く鍛えましょう。")
         
         # セッション頻度が少ない場合
-        if len(sessions) < 3:
+        if session_count < 3:
             suggestions.append("週3回以上のトレーニングを目標にしましょう。")
         
         return suggestions
     
+    def _append_session_log(self, session: WorkoutSession) -> bool:
+        """
+        完了したセッションをセッションログに1行追記（_config_lockを取得した状態で呼び出す）
+        
+        Returns:
+            ログがSESSION_LOG_COMPACT_THRESHOLD件に達し、設定ファイル全体の保存が必要な場合はTrue
+        """
+        record = asdict(session)
+        try:
+            if ORJSON_AVAILABLE:
+                line = orjson.dumps(record, default=str, option=orjson.OPT_SERIALIZE_NUMPY)
+            else:
+                line = json.dumps(record, ensure_ascii=False, default=str).encode('utf-8')
+            with open(self.session_log_path, 'ab') as f:
+                f.write(line + b"\n")
+        except Exception as e:
+            logger.error(f"セッションログの書き込みエラー: {e}")
+            return False
+        
+        self._session_log_count += 1
+        return self._session_log_count >= self.SESSION_LOG_COMPACT_THRESHOLD
+    
+    @staticmethod
+    def _session_from_dict(session_data: Dict[str, Any]) -> WorkoutSession:
+        """保存形式の辞書からWorkoutSessionを復元"""
+        session_data["start_time"] = datetime.datetime.fromisoformat(session_data["start_time"])
+        if session_data["end_time"]:
+            session_data["end_time"] = datetime.datetime.fromisoformat(session_data["end_time"])
+        return WorkoutSession(**session_data)
+    
+    def _replay_session_log(self):
+        """前回の保存以降にセッションログへ追記されたセッションを復元"""
+        # 保存の途中で終了した場合は退避したログも残っているため、古い順に両方読む
+        log_paths = [path for path in (self.session_checkpoint_path, self.session_log_path) if path.exists()]
+        if not log_paths:
+            return
+        
+        known_start_times: Dict[str, set] = {}
+        replayed = 0
+        for log_path in log_paths:
+            with open(log_path, 'rb') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        session = self._session_from_dict(orjson.loads(line) if ORJSON_AVAILABLE else json.loads(line))
+                    except Exception as e:
+                        # 書き込み途中で終了した行などはスキップ
+                        logger.warning(f"セッションログの読み込みをスキップしました: {e}")
+                        continue
+                    
+                    user = self.user_profiles.get(session.user_id)
+                    if user is None:
+                        continue
+                    # 設定ファイルに保存済みのセッションは重複して追加しない
+                    if session.user_id not in known_start_times:
+                        known_start_times[session.user_id] = {s.start_time for s in user.workout_history}
+                    if session.start_time in known_start_times[session.user_id]:
+                        continue
+                    known_start_times[session.user_id].add(session.start_time)
+                    user.workout_history.append(session)
+                    replayed += 1
+        
+        self._session_log_count = replayed
+        if replayed:
+            logger.info(f"📂 セッションログから{replayed}件のセッションを復元しました")
+    
+    def request_save(self):
+        """
+        設定の保存を予約（呼び出し元を待たせず、バックグラウンドスレッドがまとめて保存する）
+        
+        スレッドは最初の予約時に起動する（gunicornのfork後のワーカーでも動くように）
+        """
+        self._save_requested.set()
+        if self._saver_thread is not None and self._saver_thread.is_alive():
+            return
+        with self._saver_lock:
+            if self._saver_thread is None or not self._saver_thread.is_alive():
+                if self._saver_thread is None:
+                    # プロセス終了時に未保存の変更を書き出す
+                    atexit.register(self.flush_pending_save)
+                self._saver_thread = threading.Thread(
+                    target=self._background_saver, name="config-saver", daemon=True
+                )
+                self._saver_thread.start()
+    
+    def flush_pending_save(self):
+        """予約済みの保存があれば即座に保存"""
+        if self._save_requested.is_set():
+            self._save_requested.clear()
+            self.save_config()
+    
+    def _background_saver(self):
+        """保存予約を待ち、SAVE_INTERVAL秒の間に来た予約を1回の保存にまとめる"""
+        while True:
+            self._save_requested.wait()
+            time.sleep(self.SAVE_INTERVAL)
+            try:
+                self.flush_pending_save()
+            except Exception as e:
+                logger.error(f"設定のバックグラウンド保存エラー: {e}")
+    
     def save_config(self):
-        """設定とデータを保存"""
-        config_data = {
-            "user_profiles": {
-                user_id: asdict(profile) for user_id, profile in self.user_profiles.items()
-            },
-            "exercise_database": self.exercise_database
-        }
+        """設定とデータを保存（保存後はセッションログを空にする）"""
+        with self._save_lock:
+            self._save_config()
+    
+    def _save_config(self):
+        """save_configの本体（_save_lockを取得した状態で呼び出す）"""
+        # プロファイルの変更（add_user_profile, update_user_profile, end_workout_session）は
+        # _config_lockの中で行われるため、スナップショットは一貫した状態になる
+        with self._config_lock:
+            config_data = {
+                "user_profiles": {
+                    user_id: asdict(profile) for user_id, profile in self.user_profiles.items()
+                },
+                "exercise_database": self.exercise_database
+            }
+            # スナップショットに含まれたセッションのログだけを退避する
+            # （以降に完了したセッションは新しいログに追記される）
+            if self.session_log_path.exists():
+                if self.session_checkpoint_path.exists():
+                    # 前回の保存が失敗して残った退避ログには追記する
+                    with open(self.session_log_path, 'rb') as src, open(self.session_checkpoint_path, 'ab') as dst:
+                        shutil.copyfileobj(src, dst)
+                    self.session_log_path.unlink()
+                else:
+                    os.replace(self.session_log_path, self.session_checkpoint_path)
+            self._session_log_count = 0
+        
+        # 一時ファイルに書き込んでから置き換え（書き込み途中で終了しても元の設定が残る）
+        tmp_path = self.config_path.with_name(self.config_path.name + ".tmp")
+        if ORJSON_AVAILABLE:
+            # datetimeはorjsonがISO形式で直接シリアライズする（fromisoformatで復元可能）
+            payload = orjson.dumps(
+                config_data,
+                default=str,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+            )
+            with open(tmp_path, 'wb', buffering=64 * 1024) as f:
+                f.write(payload)
+        else:
+            with open(tmp_path, 'w', encoding='utf-8', buffering=64 * 1024) as f:
+                json.dump(config_data, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, self.config_path)
         
-        with open(self.config_path, 'w', encoding='utf-8') as f:
-            json.dump(config_data, f, ensure_ascii=False, indent=2, default=str)
+        # 退避したセッションは設定ファイルに含まれたので不要
+        if self.session_checkpoint_path.exists():
+            self.session_checkpoint_path.unlink()
         
         logger.info("💾 設定を保存しました")
     
@@ -461,14 +680,12 @@ YOLOの姿勢検出データと映像を組み合わせて、リアルタイム
                     if "workout_history" in profile_data:
                         workout_history = []
                         for session_data in profile_data["workout_history"]:
-                            session_data["start_time"] = datetime.datetime.fromisoformat(session_data["start_time"])
-                            if session_data["end_time"]:
-                                session_data["end_time"] = datetime.datetime.fromisoformat(session_data["end_time"])
-                            workout_history.append(WorkoutSession(**session_data))
+                            workout_history.append(self._session_from_dict(session_data))
                         profile_data["workout_history"] = workout_history
                     
                     self.user_profiles[user_id] = UserProfile(**profile_data)
             
+            self._replay_session_log()
             logger.info("📂 設定を読み込みました")
         
         except Exception as e:
@@ -506,7 +723,7 @@ async def join_call(agent: Agent, call_type: str, call_id: str, trainer: Persona
         if completed_session:
             summary = f"""
 お疲れ様でした！今回のトレーニング結果：
-- 運動: {trainer.exercise_database.get(completed_session.exercise_type, {}).get('name', completed_session.exercise_type)}
+- 運動: {trainer.exercise_names.get(completed_session.exercise_type, completed_session.exercise_type)}
 - 回数: {completed_session.rep_count}回
 - 消費カロリー: {completed_session.calories_burned:.1f}kcal
 - フォームスコア: {completed_session.form_score:.1f}/1.0
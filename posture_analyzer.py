@@ -7,11 +7,285 @@ YOLO11-Poseを使用した姿勢分析と評価システム
 import numpy as np
 import math
 import os
-from typing import Dict, List, Optional, Tuple, Any
+import sqlite3
+import threading
+import warnings
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Any
 from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta
 import json
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """numbaがない場合は通常のPython関数として実行"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+# YOLO11-Pose（COCO）のキーポイント順序
+KEYPOINT_NAMES = (
+    "nose", "left_eye", "right_eye", "left_ear", "right_ear",
+    "left_shoulder", "right_shoulder", "left_elbow", "right_elbow",
+    "left_wrist", "right_wrist", "left_hip", "right_hip",
+    "left_knee", "right_knee", "left_ankle", "right_ankle"
+)
+KEYPOINT_INDEX = {name: i for i, name in enumerate(KEYPOINT_NAMES)}
+
+# _compute_joint_angles が返す角度の並び
+JOINT_ANGLE_NAMES = (
+    "shoulder_tilt", "left_knee_angle", "right_knee_angle", "left_hip_angle", "right_hip_angle"
+)
+
+
+def keypoints_to_array(
+    keypoints: Dict[str, Tuple[float, float, float]],
+    out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    キーポイント辞書をCOCO順の (17, 3) float64 配列に変換
+    
+    検出されていないキーポイントの行は NaN になる。outを指定した場合は
+    新しい配列を確保せずにその (17, 3) 配列に書き込む。
+    """
+    if out is None:
+        kp_array = np.full((len(KEYPOINT_NAMES), 3), np.nan, dtype=np.float64)
+    else:
+        kp_array = out
+        kp_array.fill(np.nan)
+    for name, point in keypoints.items():
+        index = KEYPOINT_INDEX.get(name)
+        if index is not None:
+            kp_array[index] = point[:3]
+    return kp_array
+
+
+def array_to_keypoints(kp_array: np.ndarray) -> Dict[str, Tuple[float, float, float]]:
+    """
+    COCO順の (17, 3) 配列をキーポイント辞書に変換（NaNの行は検出なしとして除外）
+    """
+    valid = ~np.isnan(kp_array).any(axis=1)
+    rows = kp_array.tolist()
+    return {KEYPOINT_NAMES[i]: tuple(rows[i]) for i in np.flatnonzero(valid)}
+
+
+
+# 動画フレームの外れ値判定のしきい値（中央値の姿勢からのずれ、胴体長比）
+POSE_OUTLIER_MAX_DEVIATION = 0.5
+
+
+def pose_outlier_mask(kp_stack: np.ndarray, max_deviation: float = POSE_OUTLIER_MAX_DEVIATION) -> np.ndarray:
+    """
+    (T, 17, 3) のキーポイント配列から、誤検出と思われるフレームを判定
+    
+    各フレームを腰の中点が原点になるよう平行移動したうえで、キーポイントが
+    全フレームの中央値の姿勢から平均で胴体長 × max_deviation 以上ずれている
+    場合は外れ値とみなす（人物の移動ではなく姿勢の形だけを比較する）。
+    
+    Returns:
+        採用するフレームはTrueとなる長さTのbool配列（3フレーム未満の場合や
+        全フレームが外れ値になる場合はすべてTrue）
+    """
+    keep = np.ones(len(kp_stack), dtype=bool)
+    if len(kp_stack) < 3:
+        return keep
+    
+    hip_indices = [KEYPOINT_INDEX['left_hip'], KEYPOINT_INDEX['right_hip']]
+    with warnings.catch_warnings():
+        # 全フレームで未検出のキーポイントはNaNのまま扱う（All-NaN警告を抑制）
+        warnings.simplefilter('ignore', RuntimeWarning)
+        # 腰の中点（腰が未検出のフレームは検出済みキーポイントの重心）を原点にする
+        origin = np.nanmean(kp_stack[:, hip_indices, :2], axis=1)
+        missing_hip = np.isnan(origin).any(axis=1)
+        origin[missing_hip] = np.nanmean(kp_stack[missing_hip, :, :2], axis=1)
+        points = kp_stack[:, :, :2] - origin[:, None, :]
+        median_pose = np.nanmedian(points, axis=0)
+        
+        # 肩の中点から腰の中点までの距離を姿勢の大きさの基準にする
+        shoulder = np.nanmean(median_pose[[KEYPOINT_INDEX['left_shoulder'], KEYPOINT_INDEX['right_shoulder']]], axis=0)
+        hip = np.nanmean(median_pose[hip_indices], axis=0)
+    torso_length = float(np.hypot(*(shoulder - hip)))
+    if not np.isfinite(torso_length) or torso_length == 0:
+        return keep
+    
+    distances = np.linalg.norm(points - median_pose, axis=2)
+    valid = ~np.isnan(distances)
+    counts = valid.sum(axis=1)
+    deviation = np.where(valid, distances, 0.0).sum(axis=1) / np.maximum(counts, 1) / torso_length
+    keep = (deviation <= max_deviation) | (counts == 0)
+    if not keep.any():
+        keep[:] = True
+    return keep
+
+
+@njit(cache=True)
+def _joint_angle(kp, a, b, c):
+    """3点 a-b-c のbを頂点とする角度（度）"""
+    v1x = kp[a, 0] - kp[b, 0]
+    v1y = kp[a, 1] - kp[b, 1]
+    v2x = kp[c, 0] - kp[b, 0]
+    v2y = kp[c, 1] - kp[b, 1]
+    dot = v1x * v2x + v1y * v2y
+    det = v1x * v2y - v1y * v2x
+    return abs(math.degrees(math.atan2(det, dot)))
+
+
+@njit(cache=True)
+def _compute_joint_angles(kp):
+    """
+    肩の傾きと膝・股関節の角度をまとめて計算（JOINT_ANGLE_NAMESの順）
+    
+    必要なキーポイントが欠けている角度は NaN になる
+    """
+    angles = np.empty(5, dtype=np.float64)
+    # 肩の傾き（left_shoulder=5, right_shoulder=6）
+    angles[0] = abs(math.degrees(math.atan2(kp[6, 1] - kp[5, 1], kp[6, 0] - kp[5, 0])))
+    # 膝（hip-knee-ankle）
+    angles[1] = _joint_angle(kp, 11, 13, 15)
+    angles[2] = _joint_angle(kp, 12, 14, 16)
+    # 股関節（shoulder-hip-knee）
+    angles[3] = _joint_angle(kp, 5, 11, 13)
+    angles[4] = _joint_angle(kp, 6, 12, 14)
+    return angles
+
+
+# _compute_alignment_scores が返すスコアの並び
+ALIGNMENT_SCORE_NAMES = (
+    "shoulder_alignment", "hip_alignment", "head_alignment", "spine_alignment", "knee_alignment"
+)
+
+
+@njit(cache=True)
+def _tiered_score(diff, normal_threshold, acceptable_threshold):
+    """
+    ずれの大きさを0.0-1.0のスコアに変換
+    
+    正常範囲内は1.0、許容範囲内は1.0→0.7、それを超えると0.7→0.0に線形に下がる
+    """
+    if diff <= normal_threshold:
+        return 1.0
+    if diff <= acceptable_threshold:
+        return max(0.7, 1.0 - ((diff - normal_threshold) / (acceptable_threshold - normal_threshold)) * 0.3)
+    return max(0.0, 0.7 - ((diff - acceptable_threshold) / acceptable_threshold) * 0.7)
+
+
+@njit(cache=True)
+def _compute_alignment_scores(kp):
+    """
+    各部位の整列スコアをまとめて計算（ALIGNMENT_SCORE_NAMESの順）
+    
+    必要なキーポイントが欠けているスコアは NaN になる
+    """
+    scores = np.full(5, np.nan)
+    
+    # 体の高さ（肩から足首まで）。取得できない場合はデフォルト値
+    body_height = 0.0
+    if not math.isnan(kp[5, 1]) and not math.isnan(kp[15, 1]):
+        body_height = abs(kp[15, 1] - kp[5, 1])
+    elif not math.isnan(kp[6, 1]) and not math.isnan(kp[16, 1]):
+        body_height = abs(kp[16, 1] - kp[6, 1])
+    if body_height == 0.0:
+        body_height = 500.0
+    
+    has_shoulders = not math.isnan(kp[5, 0]) and not math.isnan(kp[6, 0])
+    has_hips = not math.isnan(kp[11, 0]) and not math.isnan(kp[12, 0])
+    
+    # 肩の水平度（正常: 体高の2%以内、許容: 5%以内）
+    if has_shoulders:
+        scores[0] = _tiered_score(abs(kp[5, 1] - kp[6, 1]), body_height * 0.02, body_height * 0.05)
+    
+    # 骨盤の水平度（正常: 体高の1.5%以内、許容: 4%以内）
+    if has_hips:
+        scores[1] = _tiered_score(abs(kp[11, 1] - kp[12, 1]), body_height * 0.015, body_height * 0.04)
+    
+    # 頭部の位置（耳の中心と肩の中心の関係）
+    if has_shoulders:
+        has_left_ear = not math.isnan(kp[3, 0])
+        has_right_ear = not math.isnan(kp[4, 0])
+        head_found = False
+        head_x = 0.0
+        head_y = 0.0
+        if has_left_ear and has_right_ear:
+            if kp[3, 2] > 0.2 and kp[4, 2] > 0.2:
+                head_x = (kp[3, 0] + kp[4, 0]) / 2
+                head_y = (kp[3, 1] + kp[4, 1]) / 2
+                head_found = True
+        elif has_left_ear:
+            if kp[3, 2] > 0.2:
+                head_x = kp[3, 0]
+                head_y = kp[3, 1]
+                head_found = True
+        elif has_right_ear:
+            if kp[4, 2] > 0.2:
+                head_x = kp[4, 0]
+                head_y = kp[4, 1]
+                head_found = True
+        
+        if head_found:
+            shoulder_center_x = (kp[5, 0] + kp[6, 0]) / 2
+            shoulder_center_y = (kp[5, 1] + kp[6, 1]) / 2
+            # 左右のずれ（正常: 体高の2%以内、許容: 5%以内）
+            score_h = _tiered_score(abs(head_x - shoulder_center_x), body_height * 0.02, body_height * 0.05)
+            # 前後のずれ（頭部は肩より約12%上が正常。正常: 3%以内、許容: 6%以内）
+            expected_head_y = shoulder_center_y - body_height * 0.12
+            score_v = _tiered_score(abs(head_y - expected_head_y), body_height * 0.03, body_height * 0.06)
+            # 左右60%、前後40%で統合
+            scores[2] = score_h * 0.6 + score_v * 0.4
+    
+    # 背骨の直線性（肩の中心と骨盤の中心の左右のずれ。正常: 2%以内、許容: 5%以内）
+    if has_shoulders and has_hips:
+        shoulder_center_x = (kp[5, 0] + kp[6, 0]) / 2
+        hip_center_x = (kp[11, 0] + kp[12, 0]) / 2
+        scores[3] = _tiered_score(abs(shoulder_center_x - hip_center_x), body_height * 0.02, body_height * 0.05)
+    
+    # 膝の高さ（正常: 体高の1.5%以内、許容: 4%以内）
+    if not math.isnan(kp[13, 0]) and not math.isnan(kp[14, 0]):
+        scores[4] = _tiered_score(abs(kp[13, 1] - kp[14, 1]), body_height * 0.015, body_height * 0.04)
+    
+    return scores
+
+
+if NUMBA_AVAILABLE:
+    # 最初のリクエストでJITコンパイルが走らないように事前に呼び出しておく
+    _warmup_keypoints = np.zeros((len(KEYPOINT_NAMES), 3), dtype=np.float64)
+    _compute_joint_angles(_warmup_keypoints)
+    _compute_alignment_scores(_warmup_keypoints)
+
+
+def _timestamp_to_int(timestamp: datetime) -> int:
+    """分析日時をデータベースの並び替え用の整数（マイクロ秒）に変換"""
+    return int(round(timestamp.timestamp() * 1_000_000))
+
+
+def _dumps_payload(analysis_dict: Dict[str, Any]) -> bytes:
+    """分析結果の辞書をデータベース保存用のJSONバイト列に変換"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(analysis_dict, option=orjson.OPT_SERIALIZE_NUMPY, default=str)
+    return json.dumps(analysis_dict, ensure_ascii=False, default=str).encode('utf-8')
+
+
+def _analysis_from_payload(payload: bytes) -> "PostureAnalysis":
+    """データベースのJSONバイト列からPostureAnalysisを復元"""
+    analysis_dict = orjson.loads(payload) if ORJSON_AVAILABLE else json.loads(payload)
+    analysis_dict["timestamp"] = datetime.fromisoformat(analysis_dict["timestamp"])
+    # 古いデータにmuscle_assessmentがない場合のデフォルト値
+    if "muscle_assessment" not in analysis_dict:
+        analysis_dict["muscle_assessment"] = {"tight_muscles": [], "stretch_needed": [], "strengthen_needed": []}
+    return PostureAnalysis(**analysis_dict)
+
 
 @dataclass
 class PostureKeypoint:
@@ -40,21 +314,20 @@ class PostureAnalyzer:
     """姿勢分析エンジン"""
     
     # YOLO11-Poseのキーポイント定義
-    KEYPOINT_NAMES = [
-        "nose", "left_eye", "right_eye", "left_ear", "right_ear",
-        "left_shoulder", "right_shoulder", "left_elbow", "right_elbow",
-        "left_wrist", "right_wrist", "left_hip", "right_hip",
-        "left_knee", "right_knee", "left_ankle", "right_ankle"
-    ]
+    KEYPOINT_NAMES = list(KEYPOINT_NAMES)
     
     def __init__(self):
         """姿勢分析器を初期化"""
         self.analysis_history: List[PostureAnalysis] = []
+        # スキーマ作成・JSONからの移行が済んだデータベース
+        self._initialized_dbs = set()
+        self._db_lock = threading.Lock()
     
     def analyze_posture(
         self, 
         keypoints: Dict[str, Tuple[float, float, float]], 
-        posture_type: str = "standing"
+        posture_type: str = "standing",
+        kp_array: Optional[np.ndarray] = None
     ) -> PostureAnalysis:
         """
         姿勢を分析
@@ -62,18 +335,48 @@ class PostureAnalyzer:
         Args:
             keypoints: キーポイント辞書 {name: (x, y, confidence)}
             posture_type: 姿勢タイプ (standing, sitting, walking, etc.)
+            kp_array: keypointsを変換済みの (17, 3) 配列（省略時はkeypointsから作成）
+        
+        Returns:
+            PostureAnalysis: 分析結果
+        """
+        if kp_array is None:
+            kp_array = keypoints_to_array(keypoints)
+        return self._analyze(keypoints, kp_array, posture_type)
+    
+    def analyze_posture_array(self, kp_array: np.ndarray, posture_type: str = "standing") -> PostureAnalysis:
+        """
+        COCO順の (17, 3) 配列 [x, y, confidence] から姿勢を分析
+        
+        角度・整列スコアの計算には配列をそのまま使う（辞書から配列への変換を省略）
+        
+        Args:
+            kp_array: キーポイント配列（検出されていないキーポイントの行はNaN）
+            posture_type: 姿勢タイプ (standing, sitting, walking, etc.)
         
         Returns:
             PostureAnalysis: 分析結果
         """
+        kp_array = np.ascontiguousarray(kp_array, dtype=np.float64)
+        if kp_array.shape != (len(KEYPOINT_NAMES), 3):
+            raise ValueError(f"キーポイント配列の形状が不正です: {kp_array.shape}")
+        return self._analyze(array_to_keypoints(kp_array), kp_array, posture_type)
+    
+    def _analyze(
+        self,
+        keypoints: Dict[str, Tuple[float, float, float]],
+        kp_array: np.ndarray,
+        posture_type: str
+    ) -> PostureAnalysis:
+        """analyze_posture / analyze_posture_array の共通処理"""
         # キーポイントを正規化
         normalized_keypoints = self._normalize_keypoints(keypoints)
         
         # 角度を計算
-        angles = self._calculate_angles(normalized_keypoints)
+        angles = self._calculate_angles(normalized_keypoints, kp_array)
         
         # 整列スコアを計算
-        alignment_scores = self._calculate_alignment_scores(normalized_keypoints)
+        alignment_scores = self._calculate_alignment_scores(normalized_keypoints, kp_array)
         
         # 問題点を検出
         issues = self._detect_issues(normalized_keypoints, angles, alignment_scores, posture_type)
@@ -112,16 +415,23 @@ class PostureAnalyzer:
             normalized[name] = PostureKeypoint(x=x, y=y, confidence=conf, name=name)
         return normalized
     
-    def _calculate_angles(self, keypoints: Dict[str, PostureKeypoint]) -> Dict[str, float]:
+    def _calculate_angles(
+        self,
+        keypoints: Dict[str, PostureKeypoint],
+        kp_array: Optional[np.ndarray] = None
+    ) -> Dict[str, float]:
         """各関節の角度を計算"""
         angles = {}
         
+        if kp_array is None:
+            kp_array = keypoints_to_array({name: (kp.x, kp.y, kp.confidence) for name, kp in keypoints.items()})
+        
+        # 肩の傾き・膝・股関節の角度はJITカーネルでまとめて計算
+        joint_angles = _compute_joint_angles(kp_array)
+        
         # 肩の角度（水平からの傾き）
-        if all(k in keypoints for k in ["left_shoulder", "right_shoulder"]):
-            ls = keypoints["left_shoulder"]
-            rs = keypoints["right_shoulder"]
-            shoulder_angle = math.degrees(math.atan2(rs.y - ls.y, rs.x - ls.x))
-            angles["shoulder_tilt"] = abs(shoulder_angle)
+        if not math.isnan(joint_angles[0]):
+            angles["shoulder_tilt"] = float(joint_angles[0])
         
         # 首の角度とストレートネック検出（改善: より正確な医学的基準）
         if all(k in keypoints for k in ["left_shoulder", "right_shoulder"]):
@@ -333,35 +643,10 @@ class PostureAnalyzer:
                     thoracic_angle = 180 + thoracic_angle
                 angles["thoracic_angle"] = thoracic_angle
         
-        # 膝の角度
-        if all(k in keypoints for k in ["left_hip", "left_knee", "left_ankle"]):
-            angles["left_knee_angle"] = self._calculate_joint_angle(
-                keypoints["left_hip"],
-                keypoints["left_knee"],
-                keypoints["left_ankle"]
-            )
-        
-        if all(k in keypoints for k in ["right_hip", "right_knee", "right_ankle"]):
-            angles["right_knee_angle"] = self._calculate_joint_angle(
-                keypoints["right_hip"],
-                keypoints["right_knee"],
-                keypoints["right_ankle"]
-            )
-        
-        # 股関節の角度
-        if all(k in keypoints for k in ["left_shoulder", "left_hip", "left_knee"]):
-            angles["left_hip_angle"] = self._calculate_joint_angle(
-                keypoints["left_shoulder"],
-                keypoints["left_hip"],
-                keypoints["left_knee"]
-            )
-        
-        if all(k in keypoints for k in ["right_shoulder", "right_hip", "right_knee"]):
-            angles["right_hip_angle"] = self._calculate_joint_angle(
-                keypoints["right_shoulder"],
-                keypoints["right_hip"],
-                keypoints["right_knee"]
-            )
+        # 膝・股関節の角度
+        for name, value in zip(JOINT_ANGLE_NAMES[1:], joint_angles[1:]):
+            if not math.isnan(value):
+                angles[name] = float(value)
         
         return angles
     
@@ -384,235 +669,33 @@ class PostureAnalyzer:
         angle = math.degrees(math.atan2(det, dot))
         return abs(angle)
     
-    def _calculate_alignment_scores(self, keypoints: Dict[str, PostureKeypoint]) -> Dict[str, float]:
+    def _calculate_alignment_scores(
+        self,
+        keypoints: Dict[str, PostureKeypoint],
+        kp_array: Optional[np.ndarray] = None
+    ) -> Dict[str, float]:
         """
         各部位の整列スコアを計算（0.0-1.0）
         
         専門的知識に基づく改善:
         - 医学的・運動学的基準を考慮
-        - 画像サイズに応じた相対評価
+        - 画像サイズに応じた相対評価（体高に対する割合で閾値を設定）
         - より正確な閾値設定
+        
+        計算本体はJITカーネル _compute_alignment_scores で行う
         """
-        scores = {}
-        
-        # 画像サイズを取得（相対評価のため）
-        if keypoints:
-            # 体の高さを推定（肩から足首まで）
-            body_height = 0
-            if "left_shoulder" in keypoints and "left_ankle" in keypoints:
-                ls = keypoints["left_shoulder"]
-                la = keypoints["left_ankle"]
-                body_height = abs(la.y - ls.y)
-            elif "right_shoulder" in keypoints and "right_ankle" in keypoints:
-                rs = keypoints["right_shoulder"]
-                ra = keypoints["right_ankle"]
-                body_height = abs(ra.y - rs.y)
-            
-            # 体の高さが取得できない場合はデフォルト値を使用
-            if body_height == 0:
-                body_height = 500  # デフォルト値
-            
-            # 肩の水平度（医学的基準: 2cm以内が正常、体高の約2-3%）
-            if all(k in keypoints for k in ["left_shoulder", "right_shoulder"]):
-                ls = keypoints["left_shoulder"]
-                rs = keypoints["right_shoulder"]
-                shoulder_diff = abs(ls.y - rs.y)
-                # 正常範囲: 体高の2%以内（約2cm相当）
-                normal_threshold = body_height * 0.02
-                # 許容範囲: 体高の5%以内
-                acceptable_threshold = body_height * 0.05
-                if shoulder_diff <= normal_threshold:
-                    scores["shoulder_alignment"] = 1.0
-                elif shoulder_diff <= acceptable_threshold:
-                    scores["shoulder_alignment"] = max(0.7, 1.0 - ((shoulder_diff - normal_threshold) / (acceptable_threshold - normal_threshold)) * 0.3)
-                else:
-                    scores["shoulder_alignment"] = max(0.0, 0.7 - ((shoulder_diff - acceptable_threshold) / acceptable_threshold) * 0.7)
-            
-            # 骨盤の水平度（医学的基準: 1-2cm以内が正常）
-            if all(k in keypoints for k in ["left_hip", "right_hip"]):
-                lh = keypoints["left_hip"]
-                rh = keypoints["right_hip"]
-                hip_diff = abs(lh.y - rh.y)
-                # 正常範囲: 体高の1.5%以内
-                normal_threshold = body_height * 0.015
-                # 許容範囲: 体高の4%以内
-                acceptable_threshold = body_height * 0.04
-                if hip_diff <= normal_threshold:
-                    scores["hip_alignment"] = 1.0
-                elif hip_diff <= acceptable_threshold:
-                    scores["hip_alignment"] = max(0.7, 1.0 - ((hip_diff - normal_threshold) / (acceptable_threshold - normal_threshold)) * 0.3)
-                else:
-                    scores["hip_alignment"] = max(0.0, 0.7 - ((hip_diff - acceptable_threshold) / acceptable_threshold) * 0.7)
-            
-            # 頭部の位置（肩の中心との関係、医学的基準: 2cm以内が正常）
-            # 耳の位置を使用（より正確な頭部の中心位置）
-            if all(k in keypoints for k in ["left_shoulder", "right_shoulder"]):
-                ls = keypoints["left_shoulder"]
-                rs = keypoints["right_shoulder"]
-                shoulder_center_x = (ls.x + rs.x) / 2
-                shoulder_center_y = (ls.y + rs.y) / 2
-                
-                # 耳の中心を計算（耳の位置を優先的に使用）
-                head_center_x = None
-                head_center_y = None
-                
-                # 耳が検出されている場合は耳の中心を使用（必須）
-                if "left_ear" in keypoints and "right_ear" in keypoints:
-                    le = keypoints["left_ear"]
-                    re = keypoints["right_ear"]
-                    # PostureKeypointオブジェクトかタプルかを確認
-                    le_conf = le.confidence if hasattr(le, 'confidence') else (le[2] if isinstance(le, (list, tuple)) and len(le) >= 3 else 0.0)
-                    re_conf = re.confidence if hasattr(re, 'confidence') else (re[2] if isinstance(re, (list, tuple)) and len(re) >= 3 else 0.0)
-                    
-                    # 信頼度が0.2以上であれば使用（より低い閾値で耳を優先）
-                    if le_conf > 0.2 and re_conf > 0.2:
-                        le_x = le.x if hasattr(le, 'x') else (le[0] if isinstance(le, (list, tuple)) else 0.0)
-                        le_y = le.y if hasattr(le, 'y') else (le[1] if isinstance(le, (list, tuple)) else 0.0)
-                        re_x = re.x if hasattr(re, 'x') else (re[0] if isinstance(re, (list, tuple)) else 0.0)
-                        re_y = re.y if hasattr(re, 'y') else (re[1] if isinstance(re, (list, tuple)) else 0.0)
-                        head_center_x = (le_x + re_x) / 2
-                        head_center_y = (le_y + re_y) / 2
-                
-                # 片方の耳のみ検出されている場合も使用
-                elif "left_ear" in keypoints:
-                    le = keypoints["left_ear"]
-                    le_conf = le.confidence if hasattr(le, 'confidence') else (le[2] if isinstance(le, (list, tuple)) and len(le) >= 3 else 0.0)
-                    if le_conf > 0.2:
-                        le_x = le.x if hasattr(le, 'x') else (le[0] if isinstance(le, (list, tuple)) else 0.0)
-                        le_y = le.y if hasattr(le, 'y') else (le[1] if isinstance(le, (list, tuple)) else 0.0)
-                        # 左耳の位置を頭部の中心として使用（右耳がない場合は左耳の位置を基準に右側を推定）
-                        head_center_x = le_x
-                        head_center_y = le_y
-                
-                elif "right_ear" in keypoints:
-                    re = keypoints["right_ear"]
-                    re_conf = re.confidence if hasattr(re, 'confidence') else (re[2] if isinstance(re, (list, tuple)) and len(re) >= 3 else 0.0)
-                    if re_conf > 0.2:
-                        re_x = re.x if hasattr(re, 'x') else (re[0] if isinstance(re, (list, tuple)) else 0.0)
-                        re_y = re.y if hasattr(re, 'y') else (re[1] if isinstance(re, (list, tuple)) else 0.0)
-                        # 右耳の位置を頭部の中心として使用
-                        head_center_x = re_x
-                        head_center_y = re_y
-                
-                # 頭部の中心が取得できた場合のみ評価
-                if head_center_x is not None and head_center_y is not None and body_height > 0:
-                    try:
-                        # 左右のずれ（X方向）
-                        horizontal_offset = abs(head_center_x - shoulder_center_x)
-                        
-                        # 前後のずれ（Y方向、頭部が肩より前にある場合を検出）
-                        # 正常な頭部位置: 肩の中心より少し上（体高の約10-15%上）
-                        expected_head_y = shoulder_center_y - body_height * 0.12  # 頭部は肩より約12%上
-                        vertical_offset = abs(head_center_y - expected_head_y)
-                        
-                        # 左右のずれの評価（正常範囲: 体高の2%以内）
-                        normal_threshold_h = body_height * 0.02
-                        acceptable_threshold_h = body_height * 0.05
-                        
-                        # 前後のずれの評価（正常範囲: 体高の3%以内）
-                        normal_threshold_v = body_height * 0.03
-                        acceptable_threshold_v = body_height * 0.06
-                        
-                        # ゼロ除算を防ぐ
-                        if normal_threshold_h <= 0:
-                            normal_threshold_h = 1.0
-                        if acceptable_threshold_h <= 0:
-                            acceptable_threshold_h = 1.0
-                        if normal_threshold_v <= 0:
-                            normal_threshold_v = 1.0
-                        if acceptable_threshold_v <= 0:
-                            acceptable_threshold_v = 1.0
-                        
-                        # 左右と前後のずれを統合評価
-                        score_h = 1.0
-                        if horizontal_offset <= normal_threshold_h:
-                            score_h = 1.0
-                        elif horizontal_offset <= acceptable_threshold_h:
-                            if (acceptable_threshold_h - normal_threshold_h) > 0:
-                                score_h = max(0.7, 1.0 - ((horizontal_offset - normal_threshold_h) / (acceptable_threshold_h - normal_threshold_h)) * 0.3)
-                            else:
-                                score_h = 0.7
-                        else:
-                            if acceptable_threshold_h > 0:
-                                score_h = max(0.0, 0.7 - ((horizontal_offset - acceptable_threshold_h) / acceptable_threshold_h) * 0.7)
-                            else:
-                                score_h = 0.0
-                        
-                        score_v = 1.0
-                        if vertical_offset <= normal_threshold_v:
-                            score_v = 1.0
-                        elif vertical_offset <= acceptable_threshold_v:
-                            if (acceptable_threshold_v - normal_threshold_v) > 0:
-                                score_v = max(0.7, 1.0 - ((vertical_offset - normal_threshold_v) / (acceptable_threshold_v - normal_threshold_v)) * 0.3)
-                            else:
-                                score_v = 0.7
-                        else:
-                            if acceptable_threshold_v > 0:
-                                score_v = max(0.0, 0.7 - ((vertical_offset - acceptable_threshold_v) / acceptable_threshold_v) * 0.7)
-                            else:
-                                score_v = 0.0
-                        
-                        # 左右と前後のスコアの平均（重み付け: 左右60%、前後40%）
-                        scores["head_alignment"] = score_h * 0.6 + score_v * 0.4
-                    except (ZeroDivisionError, ValueError, TypeError) as e:
-                        # エラーが発生した場合はデフォルト値を設定
-                        logger.warning(f"頭部位置評価エラー: {e}")
-                        scores["head_alignment"] = 0.5  # デフォルト値
-                elif head_center_x is not None and head_center_y is not None:
-                    # body_heightが0の場合は、左右のずれのみ評価
-                    try:
-                        horizontal_offset = abs(head_center_x - shoulder_center_x)
-                        # 固定閾値を使用（50ピクセル）
-                        if horizontal_offset <= 10:
-                            scores["head_alignment"] = 1.0
-                        elif horizontal_offset <= 25:
-                            scores["head_alignment"] = 0.7
-                        else:
-                            scores["head_alignment"] = max(0.0, 0.7 - (horizontal_offset - 25) / 25 * 0.7)
-                    except Exception as e:
-                        logger.warning(f"頭部位置評価エラー（body_height=0）: {e}")
-                        scores["head_alignment"] = 0.5  # デフォルト値
-            
-            # 背骨の直線性（医学的基準: 2cm以内の偏差が正常）
-            if all(k in keypoints for k in ["left_shoulder", "right_shoulder", "left_hip", "right_hip"]):
-                ls = keypoints["left_shoulder"]
-                rs = keypoints["right_shoulder"]
-                lh = keypoints["left_hip"]
-                rh = keypoints["right_hip"]
-                
-                shoulder_center = ((ls.x + rs.x) / 2, (ls.y + rs.y) / 2)
-                hip_center = ((lh.x + rh.x) / 2, (lh.y + rh.y) / 2)
-                
-                # 垂直方向の偏差を計算
-                vertical_alignment = abs(shoulder_center[0] - hip_center[0])
-                # 正常範囲: 体高の2%以内
-                normal_threshold = body_height * 0.02
-                # 許容範囲: 体高の5%以内
-                acceptable_threshold = body_height * 0.05
-                if vertical_alignment <= normal_threshold:
-                    scores["spine_alignment"] = 1.0
-                elif vertical_alignment <= acceptable_threshold:
-                    scores["spine_alignment"] = max(0.7, 1.0 - ((vertical_alignment - normal_threshold) / (acceptable_threshold - normal_threshold)) * 0.3)
-                else:
-                    scores["spine_alignment"] = max(0.0, 0.7 - ((vertical_alignment - acceptable_threshold) / acceptable_threshold) * 0.7)
-            
-            # 膝の位置（医学的基準: 1-2cm以内が正常）
-            if all(k in keypoints for k in ["left_knee", "right_knee"]):
-                lk = keypoints["left_knee"]
-                rk = keypoints["right_knee"]
-                knee_diff = abs(lk.y - rk.y)
-                # 正常範囲: 体高の1.5%以内
-                normal_threshold = body_height * 0.015
-                # 許容範囲: 体高の4%以内
-                acceptable_threshold = body_height * 0.04
-                if knee_diff <= normal_threshold:
-                    scores["knee_alignment"] = 1.0
-                elif knee_diff <= acceptable_threshold:
-                    scores["knee_alignment"] = max(0.7, 1.0 - ((knee_diff - normal_threshold) / (acceptable_threshold - normal_threshold)) * 0.3)
-                else:
-                    scores["knee_alignment"] = max(0.0, 0.7 - ((knee_diff - acceptable_threshold) / acceptable_threshold) * 0.7)
+        if not keypoints:
+            return {}
+        
+        if kp_array is None:
+            kp_array = keypoints_to_array({name: (kp.x, kp.y, kp.confidence) for name, kp in keypoints.items()})
         
-        return scores
+        values = _compute_alignment_scores(kp_array)
+        return {
+            name: float(value)
+            for name, value in zip(ALIGNMENT_SCORE_NAMES, values)
+            if not math.isnan(value)
+        }
     
     def _detect_issues(
         self, 
@@ -1283,49 +1366,139 @@ class PostureAnalyzer:
         else:
             return "安定"
     
-    def save_analysis(self, user_id: str, analysis: PostureAnalysis, filepath: str = "posture_analyses.json"):
-        """分析結果を保存"""
-        data = {
-            "user_id": user_id,
-            "analysis": asdict(analysis),
-            "timestamp": analysis.timestamp.isoformat()
-        }
+    def _connect(self, filepath: str) -> sqlite3.Connection:
+        """
+        分析結果のデータベースに接続（初回はテーブル作成と既存JSONからの移行を行う）
         
-        # 既存データを読み込み
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                all_data = json.load(f)
-        else:
-            all_data = []
+        Args:
+            filepath: 分析結果のJSONファイルパス（同名の.dbファイルを使用）
         
-        all_data.append(data)
+        Returns:
+            sqlite3の接続
+        """
+        db_path = str(Path(filepath).with_suffix(".db"))
+        conn = sqlite3.connect(db_path)
+        if db_path in self._initialized_dbs:
+            return conn
+        
+        with self._db_lock:
+            if db_path not in self._initialized_dbs:
+                migrated = False
+                with conn:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS analyses ("
+                        "user_id TEXT NOT NULL, ts INTEGER NOT NULL, overall_score REAL, "
+                        "posture_type TEXT, payload BLOB NOT NULL)"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_ts ON analyses(user_id, ts DESC)")
+                    empty = conn.execute("SELECT 1 FROM analyses LIMIT 1").fetchone() is None
+                    if empty and os.path.exists(filepath):
+                        self._migrate_json(conn, filepath)
+                        migrated = True
+                if migrated:
+                    # 移行済みのJSONは更新されなくなるため、現行データと取り違えないよう名前を変える
+                    os.replace(filepath, filepath + ".migrated")
+                self._initialized_dbs.add(db_path)
+        return conn
+    
+    def _migrate_json(self, conn: sqlite3.Connection, filepath: str):
+        """従来のJSONファイルに保存された分析結果をデータベースへ移行"""
+        with open(filepath, 'rb') as f:
+            all_data = orjson.loads(f.read()) if ORJSON_AVAILABLE else json.loads(f.read())
         
-        # 保存
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(all_data, f, ensure_ascii=False, indent=2, default=str)
+        rows = []
+        for data in all_data:
+            analysis_dict = data["analysis"]
+            timestamp = datetime.fromisoformat(analysis_dict["timestamp"])
+            rows.append((
+                data.get("user_id"),
+                _timestamp_to_int(timestamp),
+                analysis_dict.get("overall_score"),
+                analysis_dict.get("posture_type"),
+                _dumps_payload(analysis_dict)
+            ))
+        conn.executemany(
+            "INSERT INTO analyses (user_id, ts, overall_score, posture_type, payload) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+    
+    def save_analysis(self, user_id: str, analysis: PostureAnalysis, filepath: str = "posture_analyses.json"):
+        """分析結果を保存"""
+        with closing(self._connect(filepath)) as conn, conn:
+            conn.execute(
+                "INSERT INTO analyses (user_id, ts, overall_score, posture_type, payload) VALUES (?, ?, ?, ?, ?)",
+                (
+                    user_id,
+                    _timestamp_to_int(analysis.timestamp),
+                    float(analysis.overall_score),
+                    analysis.posture_type,
+                    _dumps_payload(asdict(analysis))
+                )
+            )
     
-    def load_analyses(self, user_id: str, filepath: str = "posture_analyses.json") -> List[PostureAnalysis]:
-        """分析結果を読み込み"""
-        if not os.path.exists(filepath):
-            return []
+    def load_analyses_recent(
+        self,
+        user_id: str,
+        limit: Optional[int] = 10,
+        filepath: str = "posture_analyses.json",
+        offset: int = 0
+    ) -> List[PostureAnalysis]:
+        """
+        分析結果を新しい順に読み込み（インデックスを使うためPython側でのソートは不要）
         
-        with open(filepath, 'r', encoding='utf-8') as f:
-            all_data = json.load(f)
+        Args:
+            user_id: ユーザーID
+            limit: 取得件数（Noneの場合は全件）
+            filepath: 分析結果のJSONファイルパス
+            offset: 読み飛ばす件数（ページング用）
         
-        user_analyses = [
-            data for data in all_data
-            if data.get("user_id") == user_id
-        ]
+        Returns:
+            新しい順の分析結果リスト
+        """
+        return list(self.iter_analyses_recent(user_id, limit, filepath, offset))
+    
+    def iter_analyses_recent(
+        self,
+        user_id: str,
+        limit: Optional[int] = None,
+        filepath: str = "posture_analyses.json",
+        offset: int = 0
+    ) -> Iterator[PostureAnalysis]:
+        """
+        load_analyses_recentと同じ順序で1件ずつ返す（全件をリストに展開しない）
         
-        # PostureAnalysisオブジェクトに変換
-        analyses = []
-        for data in user_analyses:
-            analysis_dict = data["analysis"]
-            analysis_dict["timestamp"] = datetime.fromisoformat(analysis_dict["timestamp"])
-            # 古いデータにmuscle_assessmentがない場合のデフォルト値
-            if "muscle_assessment" not in analysis_dict:
-                analysis_dict["muscle_assessment"] = {"tight_muscles": [], "stretch_needed": [], "strengthen_needed": []}
-            analyses.append(PostureAnalysis(**analysis_dict))
+        イテレーションが終わるまでデータベース接続を保持する
+        """
+        with closing(self._connect(filepath)) as conn:
+            cursor = conn.execute(
+                "SELECT payload FROM analyses WHERE user_id = ? ORDER BY ts DESC LIMIT ? OFFSET ?",
+                (user_id, -1 if limit is None else limit, offset)
+            )
+            for (payload,) in cursor:
+                yield _analysis_from_payload(payload)
+    
+    def export_analyses(self, filepath: str = "posture_analyses.json", export_path: Optional[str] = None):
+        """
+        全ユーザーの分析結果を従来形式のJSONファイルに書き出す（バックアップ用）
+        
+        Args:
+            filepath: 分析結果のJSONファイルパス（データベースの場所）
+            export_path: 書き出し先（省略時は filepath の拡張子を .export.json にしたパス）
+        """
+        with closing(self._connect(filepath)) as conn:
+            rows = conn.execute("SELECT user_id, payload FROM analyses ORDER BY rowid").fetchall()
+        
+        all_data = []
+        for user_id, payload in rows:
+            analysis_dict = orjson.loads(payload) if ORJSON_AVAILABLE else json.loads(payload)
+            all_data.append({
+                "user_id": user_id,
+                "analysis": analysis_dict,
+                "timestamp": analysis_dict["timestamp"]
+            })
         
-        return analyses
+        if export_path is None:
+            export_path = str(Path(filepath).with_suffix(".export.json"))
+        with open(export_path, 'w', encoding='utf-8') as f:
+            json.dump(all_data, f, ensure_ascii=False, indent=2, default=str)
 
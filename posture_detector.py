@@ -5,6 +5,10 @@ YOLO11-Poseを使用したリアルタイム姿勢検出
 """
 
 import numpy as np
+import os
+import queue
+import threading
+from contextlib import contextmanager
 from typing import Dict, Tuple, Optional, List
 import logging
 
@@ -21,18 +25,34 @@ class PostureDetector:
         "left_knee", "right_knee", "left_ankle", "right_ankle"
     ]
     
-    def __init__(self, model_path: str = "yolo11n-pose.pt", device: str = "cpu", conf_threshold: float = 0.25):
+    # 推論バックエンド
+    BACKENDS = ("torch", "onnx", "onnx-int8", "openvino", "openvino-int8")
+    
+    def __init__(
+        self,
+        model_path: str = "yolo11n-pose.pt",
+        device: str = "cpu",
+        conf_threshold: float = 0.25,
+        backend: str = "torch"
+    ):
         """
         姿勢検出器を初期化
         
         Args:
             model_path: YOLOモデルのパス
-            device: 使用デバイス ('cpu' または 'cuda')
+            device: 使用デバイス ('cpu' または 'cuda'、'cuda:0'など)
             conf_threshold: 信頼度閾値（デフォルト: 0.25、より敏感な検出）
+            backend: 推論バックエンド ('torch', 'onnx', 'onnx-int8', 'openvino', 'openvino-int8')
         """
+        if backend not in self.BACKENDS:
+            logger.warning(f"不明な推論バックエンドです: {backend}。torchを使用します。")
+            backend = "torch"
         self.model_path = model_path
         self.device = device
+        # GPUではFP16で推論（メモリ帯域が半分になる）
+        self.half = str(device).startswith("cuda")
         self.conf_threshold = conf_threshold
+        self.backend = backend
         self.model = None
         self._load_model()
     
@@ -40,8 +60,21 @@ class PostureDetector:
         """YOLOモデルをロード"""
         try:
             from ultralytics import YOLO
-            self.model = YOLO(self.model_path)
-            logger.info(f"YOLOモデルをロードしました: {self.model_path}")
+            if self.backend != "torch":
+                try:
+                    # ONNX Runtime / OpenVINOで推論（前処理・後処理はultralyticsがそのまま行う）
+                    if self.backend.startswith("openvino"):
+                        exported_path = self._prepare_openvino_model()
+                    else:
+                        exported_path = self._prepare_onnx_model()
+                    self.model = YOLO(exported_path, task="pose")
+                except Exception as e:
+                    # onnx / onnxruntime / openvinoが無い環境などではFP32のPyTorchモデルで続行
+                    logger.warning(f"{self.backend}モデルの準備に失敗しました: {e}。torchバックエンドを使用します。")
+                    self.backend = "torch"
+            if self.backend == "torch":
+                self.model = YOLO(self.model_path)
+            logger.info(f"YOLOモデルをロードしました: {self.model_path} (backend={self.backend})")
         except ImportError:
             logger.warning("ultralyticsがインストールされていません。ダミーモードで動作します。")
             self.model = None
@@ -49,6 +82,54 @@ class PostureDetector:
             logger.error(f"YOLOモデルのロードに失敗しました: {e}")
             self.model = None
     
+    def _prepare_onnx_model(self) -> str:
+        """
+        ONNXモデルを用意（初回のみエクスポート・量子化し、以降はファイルを再利用）
+        
+        Returns:
+            ONNXモデルのパス
+        """
+        from ultralytics import YOLO
+        
+        base_path = os.path.splitext(self.model_path)[0]
+        onnx_path = f"{base_path}.onnx"
+        if not os.path.exists(onnx_path):
+            # _preprocess_imageで640x640に揃えるため固定サイズでエクスポート
+            onnx_path = YOLO(self.model_path).export(format="onnx", imgsz=640, opset=17)
+            logger.info(f"ONNXモデルをエクスポートしました: {onnx_path}")
+        
+        if self.backend != "onnx-int8":
+            return onnx_path
+        
+        int8_path = f"{base_path}_int8.onnx"
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            # CPUのConvIntegerはuint8のみ対応のため重みはQUInt8で量子化
+            quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+            logger.info(f"int8量子化モデルを作成しました: {int8_path}")
+        return int8_path
+    
+    def _prepare_openvino_model(self) -> str:
+        """
+        OpenVINOモデルを用意（初回のみエクスポートし、以降はディレクトリを再利用）
+        
+        openvino-int8 の場合はultralyticsの既定のキャリブレーションデータで
+        INT8量子化する（初回のみデータセットのダウンロードが発生する）
+        
+        Returns:
+            OpenVINOモデルのディレクトリのパス
+        """
+        from ultralytics import YOLO
+        
+        int8 = self.backend == "openvino-int8"
+        base_path = os.path.splitext(self.model_path)[0]
+        openvino_dir = f"{base_path}{'_int8' if int8 else ''}_openvino_model"
+        if not os.path.isdir(openvino_dir):
+            # _preprocess_imageで640x640に揃えるため固定サイズでエクスポート
+            openvino_dir = YOLO(self.model_path).export(format="openvino", imgsz=640, int8=int8)
+            logger.info(f"OpenVINOモデルをエクスポートしました: {openvino_dir}")
+        return openvino_dir
+    
     def detect_keypoints(self, image: np.ndarray) -> Optional[Dict[str, Tuple[float, float, float]]]:
         """
         画像からキーポイントを検出
@@ -74,7 +155,9 @@ class PostureDetector:
                 iou=0.45,  # NMS閾値
                 imgsz=640,  # 入力画像サイズ（大きいほど精度向上）
                 verbose=False,
-                augment=True  # データ拡張で精度向上
+                augment=True,  # データ拡張で精度向上
+                device=self.device,
+                half=self.half
             )
             
             if not results or len(results) == 0:
@@ -96,54 +179,120 @@ class PostureDetector:
             if best_result is None:
                 return None
             
-            result = best_result
-            
-            # キーポイントを抽出
-            if result.keypoints is None or len(result.keypoints.data) == 0:
-                return None
-            
-            keypoints_data = result.keypoints.data[0].cpu().numpy()
-            keypoints_conf = result.keypoints.conf[0].cpu().numpy() if result.keypoints.conf is not None else None
-            
-            # 元の画像サイズと処理済み画像サイズを取得
-            orig_h, orig_w = image.shape[:2]
-            proc_h, proc_w = processed_image.shape[:2]
-            
-            # 座標変換のためのスケールを計算
-            scale_x = orig_w / proc_w
-            scale_y = orig_h / proc_h
-            
-            # キーポイント辞書を作成（信頼度フィルタリングを緩和、座標を元の画像サイズに変換）
-            keypoints = {}
-            for i, name in enumerate(self.KEYPOINT_NAMES):
-                if i < len(keypoints_data):
-                    x, y = float(keypoints_data[i][0]), float(keypoints_data[i][1])
-                    conf = float(keypoints_conf[i]) if keypoints_conf is not None and i < len(keypoints_conf) else 0.5
-                    
-                    # 座標を元の画像サイズに変換
-                    x = x * scale_x
-                    y = y * scale_y
-                    
-                    # 座標を画像範囲内に制限
-                    x = max(0, min(orig_w - 1, x))
-                    y = max(0, min(orig_h - 1, y))
-                    
-                    # 有効なキーポイントのみ追加（信頼度が0.2以上、または座標が有効）
-                    if (x > 0 and y > 0) and (conf >= 0.2 or (x > 10 and y > 10)):
-                        keypoints[name] = (x, y, max(conf, 0.3))  # 最小信頼度を0.3に設定
-            
-            # 最低限のキーポイントが検出されているか確認
-            essential_keypoints = ['left_shoulder', 'right_shoulder', 'left_hip', 'right_hip']
-            detected_essential = sum(1 for kp in essential_keypoints if kp in keypoints)
+            return self._extract_keypoints(best_result, image.shape, processed_image.shape)
+        
+        except Exception as e:
+            logger.error(f"キーポイント検出エラー: {e}")
+            return None
+    
+    def detect_keypoints_batch(self, images: List[np.ndarray]) -> List[Optional[Dict[str, Tuple[float, float, float]]]]:
+        """
+        複数の画像からキーポイントをまとめて検出（1回の推論でバッチ処理）
+        
+        Args:
+            images: 入力画像のリスト (numpy array, BGR形式)
+        
+        Returns:
+            画像ごとのキーポイント辞書（検出できなかった画像はNone）
+        """
+        if not images:
+            return []
+        
+        if self.model is None:
+            # ダミーモード: ダミーデータを返す
+            return [self._generate_dummy_keypoints(image.shape) for image in images]
+        
+        if self.backend != "torch":
+            # ONNXモデルはバッチサイズ1の固定形状でエクスポートしているため1枚ずつ推論
+            return [self.detect_keypoints(image) for image in images]
+        
+        try:
+            processed_images = [self._preprocess_image(image) for image in images]
             
-            if detected_essential < 2:  # 最低2つの必須キーポイントが必要
-                return None
+            # 全フレームを1回の推論に渡す（推論条件はdetect_keypointsと同じ）
+            results = self.model(
+                processed_images,
+                conf=self.conf_threshold,
+                iou=0.45,
+                imgsz=640,
+                verbose=False,
+                augment=True,
+                device=self.device,
+                half=self.half
+            )
             
-            return keypoints if keypoints else None
+            keypoints_list = []
+            for image, processed_image, result in zip(images, processed_images, results):
+                if (result.keypoints is None or len(result.keypoints.data) == 0
+                        or result.keypoints.conf is None or len(result.keypoints.conf) == 0):
+                    keypoints_list.append(None)
+                    continue
+                keypoints_list.append(self._extract_keypoints(result, image.shape, processed_image.shape))
+            return keypoints_list
         
         except Exception as e:
-            logger.error(f"キーポイント検出エラー: {e}")
+            logger.error(f"キーポイント一括検出エラー: {e}")
+            return [None] * len(images)
+    
+    def _extract_keypoints(
+        self,
+        result,
+        image_shape: Tuple[int, ...],
+        processed_shape: Tuple[int, ...]
+    ) -> Optional[Dict[str, Tuple[float, float, float]]]:
+        """
+        YOLOの推論結果（1画像分）からキーポイント辞書を作成
+        
+        Args:
+            result: ultralyticsの推論結果
+            image_shape: 元の画像のshape
+            processed_shape: 前処理後の画像のshape
+        
+        Returns:
+            キーポイント辞書 {name: (x, y, confidence)} または None
+        """
+        # キーポイントを抽出
+        if result.keypoints is None or len(result.keypoints.data) == 0:
+            return None
+        
+        keypoints_data = result.keypoints.data[0].cpu().numpy()
+        keypoints_conf = result.keypoints.conf[0].cpu().numpy() if result.keypoints.conf is not None else None
+        
+        # 元の画像サイズと処理済み画像サイズを取得
+        orig_h, orig_w = image_shape[:2]
+        proc_h, proc_w = processed_shape[:2]
+        
+        # 座標変換のためのスケールを計算
+        scale_x = orig_w / proc_w
+        scale_y = orig_h / proc_h
+        
+        # キーポイント辞書を作成（信頼度フィルタリングを緩和、座標を元の画像サイズに変換）
+        keypoints = {}
+        for i, name in enumerate(self.KEYPOINT_NAMES):
+            if i < len(keypoints_data):
+                x, y = float(keypoints_data[i][0]), float(keypoints_data[i][1])
+                conf = float(keypoints_conf[i]) if keypoints_conf is not None and i < len(keypoints_conf) else 0.5
+                
+                # 座標を元の画像サイズに変換
+                x = x * scale_x
+                y = y * scale_y
+                
+                # 座標を画像範囲内に制限
+                x = max(0, min(orig_w - 1, x))
+                y = max(0, min(orig_h - 1, y))
+                
+                # 有効なキーポイントのみ追加（信頼度が0.2以上、または座標が有効）
+                if (x > 0 and y > 0) and (conf >= 0.2 or (x > 10 and y > 10)):
+                    keypoints[name] = (x, y, max(conf, 0.3))  # 最小信頼度を0.3に設定
+        
+        # 最低限のキーポイントが検出されているか確認
+        essential_keypoints = ['left_shoulder', 'right_shoulder', 'left_hip', 'right_hip']
+        detected_essential = sum(1 for kp in essential_keypoints if kp in keypoints)
+        
+        if detected_essential < 2:  # 最低2つの必須キーポイントが必要
             return None
+        
+        return keypoints if keypoints else None
     
     def _preprocess_image(self, image: np.ndarray) -> np.ndarray:
         """
@@ -210,3 +359,66 @@ class PostureDetector:
             "right_ankle": (center_x + 30, center_y + 320, 0.7)
         }
 
+
+class PostureDetectorPool:
+    """
+    PostureDetectorのプール
+    
+    YOLOモデルはスレッドセーフではないため、同時に処理するリクエストごとに別の検出器を貸し出す。
+    検出器は必要になった時点で最大size個まで作成し、使用後はプールに戻して再利用する。
+    PostureDetectorと同じdetect_keypoints / detect_keypoints_batchを提供する
+    """
+    
+    def __init__(self, size: int = 1, **detector_kwargs):
+        """
+        Args:
+            size: 検出器の最大数（同時に推論できるリクエスト数）
+            **detector_kwargs: PostureDetectorに渡す引数
+        """
+        self.size = max(1, size)
+        self.detector_kwargs = detector_kwargs
+        self._idle: "queue.Queue[PostureDetector]" = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+    
+    def fill(self):
+        """最大数まで検出器を作成しておく（起動時のウォームアップ用）"""
+        while self._try_create():
+            pass
+    
+    def _try_create(self) -> bool:
+        """上限に達していなければ検出器を1つ作成してプールに追加"""
+        with self._lock:
+            if self._created >= self.size:
+                return False
+            self._created += 1
+        try:
+            self._idle.put(PostureDetector(**self.detector_kwargs))
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        return True
+    
+    @contextmanager
+    def lease(self):
+        """検出器を1つ借りる（空きがなく上限に達している場合は返却を待つ）"""
+        try:
+            detector = self._idle.get_nowait()
+        except queue.Empty:
+            self._try_create()
+            detector = self._idle.get()
+        try:
+            yield detector
+        finally:
+            self._idle.put(detector)
+    
+    def detect_keypoints(self, image: np.ndarray) -> Optional[Dict[str, Tuple[float, float, float]]]:
+        """空いている検出器でキーポイントを検出（PostureDetector.detect_keypointsと同じ）"""
+        with self.lease() as detector:
+            return detector.detect_keypoints(image)
+    
+    def detect_keypoints_batch(self, images: List[np.ndarray]) -> List[Optional[Dict[str, Tuple[float, float, float]]]]:
+        """空いている検出器でまとめて検出（PostureDetector.detect_keypoints_batchと同じ）"""
+        with self.lease() as detector:
+            return detector.detect_keypoints_batch(images)
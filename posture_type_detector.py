@@ -5,8 +5,129 @@
 """
 
 import math
+import numpy as np
 from typing import Dict, Tuple, Optional
 
+from posture_analyzer import KEYPOINT_INDEX, keypoints_to_array
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """numbaがない場合は通常のPython関数として実行"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+# _posture_type_codeの戻り値に対応する姿勢タイプ
+POSTURE_TYPES = ('unknown', 'standing_front', 'standing_side', 'standing_back')
+
+_NOSE = KEYPOINT_INDEX['nose']
+_LEFT_EYE = KEYPOINT_INDEX['left_eye']
+_RIGHT_EYE = KEYPOINT_INDEX['right_eye']
+_LEFT_SHOULDER = KEYPOINT_INDEX['left_shoulder']
+_RIGHT_SHOULDER = KEYPOINT_INDEX['right_shoulder']
+_LEFT_HIP = KEYPOINT_INDEX['left_hip']
+_RIGHT_HIP = KEYPOINT_INDEX['right_hip']
+
+
+@njit(cache=True)
+def _posture_type_code(kp):
+    """
+    (17, 3) 配列から姿勢タイプを判定し、POSTURE_TYPESの添字を返す
+    
+    未検出のキーポイントはNaN（比較は常にFalseになる）
+    """
+    # 必須キーポイントの確認
+    if (np.isnan(kp[_LEFT_SHOULDER, 0]) or np.isnan(kp[_RIGHT_SHOULDER, 0])
+            or np.isnan(kp[_LEFT_HIP, 0]) or np.isnan(kp[_RIGHT_HIP, 0])):
+        return 0
+    
+    # 肩の水平距離（X方向の距離）
+    shoulder_horizontal_distance = abs(kp[_RIGHT_SHOULDER, 0] - kp[_LEFT_SHOULDER, 0])
+    
+    # 骨盤の水平距離
+    hip_horizontal_distance = abs(kp[_RIGHT_HIP, 0] - kp[_LEFT_HIP, 0])
+    
+    # 体の幅（肩と骨盤の平均幅）
+    body_width = (shoulder_horizontal_distance + hip_horizontal_distance) / 2
+    
+    # 体の高さ（肩から骨盤までの距離）
+    shoulder_center_y = (kp[_LEFT_SHOULDER, 1] + kp[_RIGHT_SHOULDER, 1]) / 2
+    hip_center_y = (kp[_LEFT_HIP, 1] + kp[_RIGHT_HIP, 1]) / 2
+    body_height = abs(hip_center_y - shoulder_center_y)
+    
+    # アスペクト比（幅/高さ）
+    if body_height > 0:
+        aspect_ratio = body_width / body_height
+    else:
+        aspect_ratio = 1.0
+    
+    # 判定ロジック
+    # 1. 正面判定: 肩と骨盤の水平距離が大きく、垂直距離が小さい
+    # 2. 横向き判定: 肩と骨盤の水平距離が小さく、体が横を向いている
+    # 3. 背面判定: 顔のキーポイント（nose, eyes）が検出されない、または信頼度が低い
+    
+    # 顔のキーポイントの確認
+    face_detected = 0
+    if kp[_NOSE, 2] > 0.3:
+        face_detected += 1
+    if kp[_LEFT_EYE, 2] > 0.3:
+        face_detected += 1
+    if kp[_RIGHT_EYE, 2] > 0.3:
+        face_detected += 1
+    nose_conf = 0.0 if np.isnan(kp[_NOSE, 2]) else kp[_NOSE, 2]
+    
+    # 肩の水平度（水平距離が大きいほど正面）
+    shoulder_horizontal_ratio = shoulder_horizontal_distance / max(body_height, 1.0)
+    
+    # 骨盤の水平度
+    hip_horizontal_ratio = hip_horizontal_distance / max(body_height, 1.0)
+    
+    # 判定スコア
+    front_score = 0
+    side_score = 0
+    back_score = 0
+    
+    # 正面スコア: 肩と骨盤の水平距離が大きく、顔が検出されている
+    if shoulder_horizontal_ratio > 0.3 and hip_horizontal_ratio > 0.3:
+        front_score += 2
+    if face_detected >= 2:
+        front_score += 2
+    if aspect_ratio > 0.4:  # 体の幅が広い（正面から見た場合）
+        front_score += 1
+    
+    # 横向きスコア: 肩と骨盤の水平距離が小さく、体が縦長
+    if shoulder_horizontal_ratio < 0.2 and hip_horizontal_ratio < 0.2:
+        side_score += 3
+    if aspect_ratio < 0.3:  # 体が縦長（横から見た場合）
+        side_score += 2
+    if face_detected == 1:  # 顔が一部しか見えない
+        side_score += 1
+    
+    # 背面スコア: 顔のキーポイントが検出されない、または信頼度が低い
+    if face_detected == 0:
+        back_score += 3
+    elif face_detected == 1 and nose_conf < 0.3:
+        back_score += 2
+    if shoulder_horizontal_ratio > 0.25 and hip_horizontal_ratio > 0.25:
+        back_score += 1  # 肩と骨盤が水平（背面から見た場合も同様）
+    
+    # 最も高いスコアの姿勢タイプを返す
+    if front_score >= side_score and front_score >= back_score:
+        return 1
+    elif side_score >= back_score:
+        return 2
+    elif back_score > 0:
+        return 3
+    else:
+        # デフォルトは正面
+        return 1
+
 
 class PostureTypeDetector:
     """姿勢タイプを自動判定するクラス"""
@@ -30,102 +151,16 @@ class PostureTypeDetector:
         """
         if not keypoints:
             return 'unknown'
+        return self.detect_posture_type_array(keypoints_to_array(keypoints))
+    
+    def detect_posture_type_array(self, kp_array: np.ndarray) -> str:
+        """
+        COCO順の (17, 3) 配列（未検出はNaN）から姿勢タイプを自動判定
         
-        # 必須キーポイントの確認
-        required_keypoints = ['left_shoulder', 'right_shoulder', 'left_hip', 'right_hip']
-        if not all(kp in keypoints for kp in required_keypoints):
-            return 'unknown'
-        
-        # 肩の位置関係を分析
-        ls = keypoints['left_shoulder']
-        rs = keypoints['right_shoulder']
-        lh = keypoints['left_hip']
-        rh = keypoints['right_hip']
-        
-        # 肩の水平距離（X方向の距離）
-        shoulder_horizontal_distance = abs(rs[0] - ls[0])
-        
-        # 肩の垂直距離（Y方向の距離）
-        shoulder_vertical_distance = abs(rs[1] - ls[1])
-        
-        # 骨盤の水平距離
-        hip_horizontal_distance = abs(rh[0] - lh[0])
-        
-        # 骨盤の垂直距離
-        hip_vertical_distance = abs(rh[1] - lh[1])
-        
-        # 肩と骨盤の中心点
-        shoulder_center_x = (ls[0] + rs[0]) / 2
-        hip_center_x = (lh[0] + rh[0]) / 2
-        
-        # 体の幅（肩と骨盤の平均幅）
-        body_width = (shoulder_horizontal_distance + hip_horizontal_distance) / 2
-        
-        # 体の高さ（肩から骨盤までの距離）
-        shoulder_center_y = (ls[1] + rs[1]) / 2
-        hip_center_y = (lh[1] + rh[1]) / 2
-        body_height = abs(hip_center_y - shoulder_center_y)
-        
-        # アスペクト比（幅/高さ）
-        if body_height > 0:
-            aspect_ratio = body_width / body_height
-        else:
-            aspect_ratio = 1.0
-        
-        # 判定ロジック
-        # 1. 正面判定: 肩と骨盤の水平距離が大きく、垂直距離が小さい
-        # 2. 横向き判定: 肩と骨盤の水平距離が小さく、体が横を向いている
-        # 3. 背面判定: 顔のキーポイント（nose, eyes）が検出されない、または信頼度が低い
-        
-        # 顔のキーポイントの確認
-        face_keypoints = ['nose', 'left_eye', 'right_eye']
-        face_detected = sum(1 for kp in face_keypoints if kp in keypoints and keypoints[kp][2] > 0.3)
-        
-        # 肩の水平度（水平距離が大きいほど正面）
-        shoulder_horizontal_ratio = shoulder_horizontal_distance / max(body_height, 1.0)
-        
-        # 骨盤の水平度
-        hip_horizontal_ratio = hip_horizontal_distance / max(body_height, 1.0)
-        
-        # 判定スコア
-        front_score = 0
-        side_score = 0
-        back_score = 0
-        
-        # 正面スコア: 肩と骨盤の水平距離が大きく、顔が検出されている
-        if shoulder_horizontal_ratio > 0.3 and hip_horizontal_ratio > 0.3:
-            front_score += 2
-        if face_detected >= 2:
-            front_score += 2
-        if aspect_ratio > 0.4:  # 体の幅が広い（正面から見た場合）
-            front_score += 1
-        
-        # 横向きスコア: 肩と骨盤の水平距離が小さく、体が縦長
-        if shoulder_horizontal_ratio < 0.2 and hip_horizontal_ratio < 0.2:
-            side_score += 3
-        if aspect_ratio < 0.3:  # 体が縦長（横から見た場合）
-            side_score += 2
-        if face_detected == 1:  # 顔が一部しか見えない
-            side_score += 1
-        
-        # 背面スコア: 顔のキーポイントが検出されない、または信頼度が低い
-        if face_detected == 0:
-            back_score += 3
-        elif face_detected == 1 and keypoints.get('nose', (0, 0, 0))[2] < 0.3:
-            back_score += 2
-        if shoulder_horizontal_ratio > 0.25 and hip_horizontal_ratio > 0.25:
-            back_score += 1  # 肩と骨盤が水平（背面から見た場合も同様）
-        
-        # 最も高いスコアの姿勢タイプを返す
-        if front_score >= side_score and front_score >= back_score:
-            return 'standing_front'
-        elif side_score >= back_score:
-            return 'standing_side'
-        elif back_score > 0:
-            return 'standing_back'
-        else:
-            # デフォルトは正面
-            return 'standing_front'
+        判定はnumbaでコンパイルした_posture_type_codeで行う
+        """
+        kp_array = np.ascontiguousarray(kp_array, dtype=np.float64)
+        return POSTURE_TYPES[_posture_type_code(kp_array)]
     
     def get_posture_type_confidence(
         self,
@@ -148,6 +183,19 @@ class PostureTypeDetector:
         confidence = detected_count / len(required_keypoints)
         
         return (posture_type, confidence)
+    
+    def get_posture_type_confidence_array(self, kp_array: np.ndarray) -> Tuple[str, float]:
+        """
+        COCO順の (17, 3) 配列から姿勢タイプと信頼度を返す（get_posture_type_confidenceの配列版）
+        """
+        kp_array = np.ascontiguousarray(kp_array, dtype=np.float64)
+        posture_type = POSTURE_TYPES[_posture_type_code(kp_array)]
+        
+        # 信頼度の計算（簡易版）: 必須キーポイントの検出率
+        required = kp_array[[_LEFT_SHOULDER, _RIGHT_SHOULDER, _LEFT_HIP, _RIGHT_HIP], 0]
+        confidence = float(np.count_nonzero(~np.isnan(required))) / len(required)
+        
+        return (posture_type, confidence)
 
 
 
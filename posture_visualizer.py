@@ -15,6 +15,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# テキストサイズ測定用の描画コンテキスト（textbboxの結果は画像サイズに依存しない）
+_MEASURE_DRAW = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+
 
 class PostureVisualizer:
     """姿勢可視化クラス"""
@@ -49,11 +52,20 @@ class PostureVisualizer:
     
     def __init__(self):
         """可視化器を初期化"""
+        # サイズごとに読み込んだフォント（テキスト描画のたびにファイルを読み直さない）
+        self._font_cache: Dict[int, ImageFont.ImageFont] = {}
         # 日本語フォントのパスを取得
         self.japanese_font = self._get_japanese_font()
     
     def _get_japanese_font(self, size=20):
-        """日本語フォントを取得"""
+        """日本語フォントを取得（サイズごとにキャッシュ）"""
+        font = self._font_cache.get(size)
+        if font is None:
+            font = self._font_cache[size] = self._load_japanese_font(size)
+        return font
+    
+    def _load_japanese_font(self, size):
+        """日本語フォントをファイルから読み込む"""
         try:
             # システムフォントを試す（macOS, Linux, Windows）
             font_paths = [
@@ -104,21 +116,18 @@ class PostureVisualizer:
                 logger.warning("空の画像が渡されました")
                 return image
             
-            # OpenCV画像をPIL画像に変換（BGR -> RGB）
-            pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            # BGRのままPIL画像にする（色もBGRの順で渡せば変換不要）
+            pil_image = Image.fromarray(image)
             draw = ImageDraw.Draw(pil_image)
             
             # フォントを取得
             font = self._get_japanese_font(font_size)
             
             # テキストを描画
-            # PILの色はRGB形式なので、BGRからRGBに変換
-            rgb_color = (color[2], color[1], color[0])
-            draw.text(position, text, font=font, fill=rgb_color)
+            draw.text(position, text, font=font, fill=tuple(color))
             
-            # PIL画像をOpenCV画像に変換（RGB -> BGR）
-            result = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-            return result
+            # PIL画像をOpenCV画像（BGR）に戻す
+            return np.array(pil_image)
         except Exception as e:
             logger.warning(f"日本語テキスト描画エラー（フォールバック）: {e}")
             # エラー時はOpenCVのデフォルトフォントで描画（英語のみ）
@@ -133,10 +142,7 @@ class PostureVisualizer:
         """日本語テキストのサイズを取得"""
         try:
             font = self._get_japanese_font(font_size)
-            # ダミー画像でサイズを測定
-            dummy_img = Image.new('RGB', (1000, 1000), (0, 0, 0))
-            draw = ImageDraw.Draw(dummy_img)
-            bbox = draw.textbbox((0, 0), text, font=font)
+            bbox = _MEASURE_DRAW.textbbox((0, 0), text, font=font)
             width = bbox[2] - bbox[0]
             height = bbox[3] - bbox[1]
             return (width, height)
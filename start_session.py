@@ -108,15 +108,13 @@ async def start_training_session(user_id: str, exercise_type: str):
                 print(f"   - 消費カロリー: {completed_session.calories_burned:.1f}kcal")
                 print(f"   - フォームスコア: {completed_session.form_score:.1f}/1.0")
                 
-                # 設定を保存
-                trainer.save_config()
+                # セッションはend_workout_sessionでセッションログに追記済み
                 print("\n💾 データを保存しました")
         else:
             print("セッションは継続中です。")
     except KeyboardInterrupt:
         print("\n\nセッションを中断しました。")
-        completed_session = trainer.end_workout_session()
-        trainer.save_config()
+        trainer.end_workout_session()
 
 
 async def main():
@@ -0,0 +1,46 @@
+"""
+posture_analyzerの外れ値判定のテスト
+
+実行: python -m pytest -q test_posture_analyzer.py
+"""
+
+import numpy as np
+
+from posture_analyzer import KEYPOINT_INDEX, pose_outlier_mask
+
+
+def _standing_pose():
+    """正面から見た立ち姿勢の (17, 3) キーポイント配列"""
+    pose = np.full((17, 3), np.nan)
+    points = {
+        'nose': (200, 100), 'left_eye': (210, 90), 'right_eye': (190, 90),
+        'left_ear': (220, 95), 'right_ear': (180, 95),
+        'left_shoulder': (240, 160), 'right_shoulder': (160, 160),
+        'left_elbow': (250, 230), 'right_elbow': (150, 230),
+        'left_wrist': (255, 300), 'right_wrist': (145, 300),
+        'left_hip': (225, 320), 'right_hip': (175, 320),
+        'left_knee': (225, 420), 'right_knee': (175, 420),
+        'left_ankle': (225, 520), 'right_ankle': (175, 520),
+    }
+    for name, (x, y) in points.items():
+        pose[KEYPOINT_INDEX[name]] = (x, y, 0.9)
+    return pose
+
+
+def test_translated_pose_is_kept():
+    """画面内を移動しただけの同じ姿勢は外れ値にしない"""
+    pose = _standing_pose()
+    stack = np.stack([pose, pose, pose])
+    stack[0, :, 0] -= 200  # 最初のフレームは左に胴体長以上ずれている
+    stack[2, :, :2] += (150, 40)
+    assert pose_outlier_mask(stack).all()
+
+
+def test_misdetected_pose_is_dropped():
+    """形の崩れた誤検出フレームは外れ値として除外する"""
+    pose = _standing_pose()
+    broken = pose.copy()
+    broken[:, :2] = pose[::-1, :2]  # キーポイントの対応が入れ替わった誤検出
+    stack = np.stack([pose, pose, broken, pose])
+    assert pose_outlier_mask(stack).tolist() == [True, True, False, True]
+